@@ -1,37 +1,25 @@
-import re
-import calendar
+import os
 import pandas as pd
 from io import BytesIO
 import streamlit as st
 import dataprocess as dp  # 根据实际处理需求 编写的数据处理模块
-import concurrent.futures
+import export
+import filecache
+import history
+import jobs
+import monthly
+import report
+from profiling import Profiler, stage
 from datetime import date
-from openpyxl.styles import Font, Alignment, PatternFill, NamedStyle
-from openpyxl.utils import get_column_letter
-from openpyxl.formatting.rule import DataBarRule, FormulaRule
 
-def add_data_bar_rule(worksheet, start_row, end_row, column, color="c00000"):
-    # 范围字符串
-    range_str = f'{column}{start_row}:{column}{end_row}'
-    # 添加条件格式规则，排除负数
-    negative_rule = FormulaRule(formula=[f'AND({column}{start_row}<0)'], stopIfTrue=True)
-    worksheet.conditional_formatting.add(range_str, negative_rule)
-    # 添加数据条规则
-    data_bar_rule = DataBarRule(
-        start_type='num', start_value=0,
-        end_type='max',
-        color=color
+# 上传文件解析结果的磁盘缓存，整个服务进程共用一个实例
+@st.cache_resource
+def get_upload_cache():
+    cache_config = st.secrets.get("cache", {})
+    return filecache.ParquetCache(
+        cache_dir=cache_config.get("upload_dir", ".cache/uploads"),
+        max_bytes=int(cache_config.get("upload_max_mb", 512)) * 1024 * 1024
     )
-    worksheet.conditional_formatting.add(range_str, data_bar_rule)
-
-# 使用缓存来存储处理后的 DataFrame
-@st.cache_data
-def load_excel_files(uploaded_files):
-    dfs = {}
-    for uploaded_file in uploaded_files:
-        df = pd.read_excel(uploaded_file, header=17)
-        dfs[uploaded_file.name] = df
-    return dfs
 
 # 使用缓存来存储处理后的数据
 @st.cache_data
@@ -43,180 +31,157 @@ def process_data(dfs):
     df_all = pd.concat(df_lst, axis=0)
     return df_all
 
-# 将 Pandas DataFrame 对象转换为 Excel 文件格式的字节流
+# 报表文件缓存：内存中按 LRU 保留，超出内存上限的报表转存磁盘，超过有效期后失效
 @st.cache_resource
-def to_excel(df1, df3 ,df2, df4,sheet_name1='物料',sheet_name3='成品',sheet_name2='异常类别定义', sheet_name4='半成品在库天数'):
-    output = BytesIO()
-    writer = pd.ExcelWriter(output, engine='openpyxl')
-    df2.to_excel(writer, index=False, header=False,sheet_name=sheet_name2)
-    df1.to_excel(writer, index=False, sheet_name=sheet_name1)
-    df3.to_excel(writer, index=False, sheet_name=sheet_name3)
-    df4.to_excel(writer, index=False, sheet_name=sheet_name4)
-    # 获取工作簿和工作表
-    workbook = writer.book
-    worksheet1 = writer.sheets[sheet_name1]
-    worksheet2= writer.sheets[sheet_name2]
-    worksheet3= writer.sheets[sheet_name3]
-
-        # 确保百分比样式只被创建一次
-    if "percentage_style" not in workbook.named_styles:
-        percentage_style = NamedStyle(name="percentage_style", number_format='0.00%')
-        workbook.add_named_style(percentage_style)
-    else:
-        percentage_style = workbook.named_styles["percentage_style"]
-    # 调用格式设置函数
-    set_description_sheet_format(worksheet2, df2)
-    set_material_sheet_format(worksheet1, df1, percentage_style)
-    set_material_sheet_format(worksheet3, df3, percentage_style)
-    # 增加数据条
-    add_data_bar_rule(worksheet1,start_row=2, end_row=len(df1) + 1, column='F')
-    add_data_bar_rule(worksheet3,start_row=2, end_row=len(df3) + 1, column='F')
-
-    worksheet4 = writer.sheets[sheet_name4]
-    # ========== 半产品在库天数的Excel Sheet 格式设置 ==========
-    # 设置 B~E 列列宽为 40
-    for col_idx in range(2, 6):  # 2,3,4,5 对应 B,C,D,E 列
-        col_letter = get_column_letter(col_idx)  # 将索引转为Excel列字母（如 2->B）
-        worksheet4.column_dimensions[col_letter].width = 28
-    # C列居中显示
-    c_col_center_alignment = Alignment(
-        horizontal="center",  # 水平居中
-        vertical="center"    # 垂直居中
+def get_report_cache():
+    cache_config = st.secrets.get("cache", {})
+    return filecache.ArtifactCache(
+        max_bytes=int(cache_config.get("report_max_mb", 256)) * 1024 * 1024,
+        ttl=float(cache_config.get("report_ttl_hours", 168)) * 3600,
+        spill_dir=cache_config.get("report_dir", ".cache/reports")
     )
-    # 定位C列（索引3），转换为列字母
-    c_col_idx = 3
-    c_col_letter = get_column_letter(c_col_idx)
-    # 应用到C列所有有数据的单元格（包含表头和数据行）
-    # 遍历C列所有行（从第1行表头到最后一行数据）
-    for row_idx in range(1, worksheet4.max_row + 1):
-        cell = worksheet4[f"{c_col_letter}{row_idx}"]
-        cell.alignment = c_col_center_alignment
-    # 创建并应用日期格式
-    date_style = NamedStyle(name="date_style")
-    date_style.number_format = "yyyy-mm-dd"  # 日期格式
-    date_style.alignment = Alignment(horizontal="center")  # 居中对齐
-    # 获取生产日期、失效日期列索引（openpyxl 列索引从1开始，需+1）
-    header_names = df4.columns.tolist()
-    produce_date_col = header_names.index("生产日期") + 1  # 关键：+1 适配 openpyxl 索引
-    expire_date_col = header_names.index("失效日期") + 1
-    # 应用日期格式到整列
-    for col_idx in [produce_date_col, expire_date_col]:
-        col_letter = get_column_letter(col_idx)
-        # 循环应用到该列所有有数据的单元格（可按需调整行数范围）
-        for row_idx in range(2, worksheet4.max_row + 1):  # 第2行开始（跳过表头）
-            cell = worksheet4[f"{col_letter}{row_idx}"]
-            cell.style = date_style
 
+# 月度处理结果历史库
+@st.cache_resource
+def get_history_store():
+    return history.HistoryStore(st.secrets.get("history", {}).get("path", "history/inventory_history.sqlite"))
 
-    # 设置首行表头格式（蓝色填充 + 白色加粗，第2/7列浅黄色填充）
-    # 定义表头样式
-    header_fill = PatternFill(start_color="346c9c", end_color="346c9c", fill_type="solid")  # 蓝色填充
-    # 浅蓝色填充样式（首行第2、8列专用）
-    header_yellow_fill = PatternFill(start_color="31869b", end_color="31869b", fill_type="solid")
-    header_font = Font(color="FFFFFF", bold=True)  # 白色加粗字体
-    header_alignment = Alignment(horizontal="center", vertical="center")  # 居中对齐
+# 后台任务执行器，整个服务进程共用，多个用户提交的任务排队执行，不占用页面脚本线程
+@st.cache_resource
+def get_job_runner():
+    return jobs.JobRunner(max_workers=int(st.secrets.get("jobs", {}).get("max_workers", 2)))
 
-    # 应用到首行（第1行，openpyxl 行索引从1开始）
-    for col_idx in range(1, len(header_names) + 1):
-        cell = worksheet4.cell(row=1, column=col_idx)
-        cell.font = header_font
-        cell.alignment = header_alignment
-        # 关键修改：条件判断应用对应填充色
-        if col_idx == 2 or col_idx == 8:
-            cell.fill = header_yellow_fill
-        else:
-            cell.fill = header_fill
-    
-    writer.close()
+# 将 Pandas DataFrame 对象转换为 Excel 文件格式的字节流
+def to_excel(df1, df3 ,df2, df4,sheet_name1='物料',sheet_name3='成品',sheet_name2='异常类别定义', sheet_name4='半成品在库天数', df5=None, df6=None, profiler=None):
+    output = BytesIO()
+    report.write_report(output, df1, df3, df2, df4, sheet_name1=sheet_name1, sheet_name3=sheet_name3,
+                        sheet_name2=sheet_name2, sheet_name4=sheet_name4, df5=df5, df6=df6, profiler=profiler)
     processed_data = output.getvalue()
     return processed_data
 
-def set_material_sheet_format(worksheet, df1, percentage_style):
-    # 设置列宽
-    for idx, column in enumerate(worksheet.columns, start=1):
-        column_letter = column[0].column_letter
-        if idx == 1:
-            worksheet.column_dimensions[column_letter].width = 14
-        elif idx == 6:
-            worksheet.column_dimensions[column_letter].width = 22
-        elif idx == 9:
-            worksheet.column_dimensions[column_letter].width = 30
-        else:
-            worksheet.column_dimensions[column_letter].width = 16
-    # 应用百分比格式到指定列
-    column_name = '%(剩余效期/总效期)'
-    column_index = df1.columns.get_loc(column_name) + 1  # +1 是因为 Excel 列索引从 1 开始
-    for row in worksheet.iter_rows(min_row=2, max_row=worksheet.max_row, min_col=column_index, max_col=column_index):
-        for cell in row:
-            cell.style = percentage_style
-    # 定义将 RGB 颜色值转换为十六进制颜色代码的函数
-    def rgb_to_hex(r, g, b):
-        return '{:02x}{:02x}{:02x}'.format(r, g, b)
-    # 定义不同列所需的颜色
-    colors = {
-        1: rgb_to_hex(226, 107, 10),
-        2: rgb_to_hex(49, 134, 155),
-        3: rgb_to_hex(226, 107, 10),
-        4: rgb_to_hex(226, 107, 10),
-        5: rgb_to_hex(226, 107, 10),
-        6: rgb_to_hex(118, 147, 60),
-        7: rgb_to_hex(118, 147, 60)
+# 各阶段开始时的任务进度（未列出的阶段只更新说明）
+STAGE_PROGRESS = {'读取上月处理结果': 0.02, '读取库存文件': 0.05, '分类计算': 0.45, '匹配上月处理方案': 0.55,
+                  '保存历史记录': 0.6, '生成报表': 0.65, '写出工作表[物料]': 0.66, '写出工作表[成品]': 0.75,
+                  '写出工作表[半成品在库天数]': 0.8, '保存工作簿': 0.95}
+
+# 导出方式：(是否导出为 zip, 附带的明细格式)
+EXPORT_MODES = {
+    "Excel 报表": (False, None),
+    "压缩包（Excel 按行数拆分）": (True, None),
+    "压缩包（Excel + CSV 明细）": (True, "csv"),
+    "压缩包（Excel + Parquet 明细）": (True, "parquet"),
+}
+
+def export_settings():
+    export_config = st.secrets.get("export", {})
+    return {
+        'dir': export_config.get("dir", ".cache/exports"),
+        'rows_per_file': int(export_config.get("rows_per_file", export.ROWS_PER_FILE)),
+        'max_age': float(export_config.get("max_age_hours", 24)) * 3600,
     }
-    # 默认颜色
-    default_color = "346c9c"
-    # 遍历第一行的每个单元格
-    for col_index, cell in enumerate(worksheet[1], start=1):
-        # 设置字体为加粗，颜色为白色
-        cell.font = Font(bold=True, color="FFFFFF")
-        # 根据列索引获取相应的颜色，如果没有指定则使用默认颜色
-        fill_color = colors.get(col_index, default_color)
-        # 设置填充颜色
-        cell.fill = PatternFill(start_color=fill_color, end_color=fill_color, fill_type="solid")
-        # 设置单元格内容居中对齐
-        cell.alignment = Alignment(horizontal="center", vertical="center")
-    for row in worksheet.iter_rows(min_row=2, max_row=worksheet.max_row, min_col=1, max_col=worksheet.max_column):
-        for cell in row:
-            if cell.column == 9 :  # G列是第7列 or cell.column == 14
-                cell.alignment = Alignment(horizontal="left", vertical="center")
-            else:
-                cell.alignment = Alignment(horizontal="center", vertical="center")
 
+def stage_reporter(job):
+    # 将处理阶段的开始/结束转换为任务进度及说明
+    def on_stage(record, finished):
+        if finished:
+            rows = record['输出行数'] if record['输出行数'] is not None else record['输入行数']
+            message = f"{record['阶段']} 完成" + (f"（{rows} 行）" if rows is not None else "")
+        else:
+            message = f"{record['阶段']}..."
+        progress = STAGE_PROGRESS.get(record['阶段']) if not finished else None
+        job.report(message, progress)
+    return on_stage
 
-def set_description_sheet_format(worksheet, df2):
-    # 设置列宽
-    worksheet.column_dimensions['A'].width = 22
-    worksheet.column_dimensions['B'].width = 108
-    # 设置行高
-    for row in range(1, 12):  # 1~11行行高设置为36
-        worksheet.row_dimensions[row].height = 36
-    # 设置标题样式
-    for cell in worksheet[1]:
-        cell.font = Font(bold=True, size=16)
-        cell.alignment = Alignment(horizontal="center", vertical="center")
-    # 设置剩余行的标题样式
-    for row in range(2, worksheet.max_row + 1):  # 从第二行开始
-        for cell in worksheet[row]:
-            cell.font = Font(size=14, color="000000")
-            cell.alignment = Alignment(horizontal="left", vertical="center")
-    # 合并A1和B1
-    worksheet.merge_cells('A1:B1')
-    # 设置合并单元格的对齐方式
-    worksheet['A1'].alignment = Alignment(horizontal="center", vertical="center")
-    # 保证样式设置不会被合并操作覆盖
-    for row in worksheet['A1:B1']:
-        for cell in row:
-            cell.font = Font(bold=True, size=16)
-            cell.alignment = Alignment(horizontal="center", vertical="center")
-    # 设置A2:A8单元格的样式
-    for row in worksheet['A2:A11']:
-        for cell in row:
-            cell.font = Font(size=14, color="000000")
-            cell.alignment = Alignment(horizontal="left", vertical="center")
-    # 设置C2:C8单元格的样式
-    for row in worksheet['C2:C11']:
-        for cell in row:
-            cell.font = Font(size=14, color="000000", bold=True)
-            cell.alignment = Alignment(horizontal="center", vertical="center")
+# 完整的数据处理流程（在后台任务中执行，不调用页面元素）；old_data 为 None 时从历史库读取上月处理方案
+# 报表、分类汇总及变动明细存入报表缓存，任务结果只保留缓存键，不在任务中长期持有报表字节流：
+# 返回 {'report_key': 报表缓存键, 'messages': 处理说明, 'profile': 各阶段记录}
+# export_options 不为 None 时按 {'path', 'table_format', 'rows_per_file'} 写出 zip 文件，结果中另有 'export_path'
+def process_uploads(job, sources, old_data, date_value, warehouses, max_workers, upload_cache, store,
+                    report_cache, report_key, export_options=None):
+    profiler = Profiler(on_stage=stage_reporter(job))
+    month = history.month_of(date_value)
+    old_results = monthly.resolve_old_results(store, month, old_data, profiler=profiler)
+    # 读取文件（优先使用解析缓存）并完成分类及上月处理方案匹配
+    cache_stats = dict(upload_cache.stats)
+    result = monthly.process_inventory(sources, date_value, warehouses, old_results,
+                                       cache=upload_cache, max_workers=max_workers, profiler=profiler)
+    messages = [f"文件解析缓存：命中 {upload_cache.stats['hits'] - cache_stats['hits']} 个，"
+                f"未命中 {upload_cache.stats['misses'] - cache_stats['misses']} 个"]
+    for sheet_name, match_stats in result['match_stats'].items():
+        messages.append(f"{sheet_name}：上月处理方案匹配 {match_stats['匹配行数']}/{match_stats['行数']} 行"
+                        f"（{match_stats['匹配率']:.1%}），上月重复键 {match_stats['上月重复键数']} 个")
+    sheets = result['sheets']
+    # 本月分类结果存入历史库
+    with stage(profiler, '保存历史记录'):
+        store.save_run(month, sheets)
+    # 汇总结果与报表一起缓存，再次查看时无需读取明细
+    report_cache.put(summary_key(report_key), filecache.frame_to_bytes(result['summary']))
+    report_cache.put(summary_key(report_key, '变动明细'), filecache.frame_to_bytes(result['delta']))
+    if export_options is not None:
+        # 大报表直接写入磁盘上的 zip 文件，不经过内存，也不放入报表缓存
+        monthly.write_monthly_export(export_options['path'], sheets, summary=result['summary'], delta=result['delta'],
+                                     table_format=export_options['table_format'],
+                                     rows_per_file=export_options['rows_per_file'], profiler=profiler)
+        job.report("报表已生成", 1.0)
+        return {'report_key': report_key, 'export_path': export_options['path'], 'messages': messages,
+                'profile': profiler}
+    # 生成 Excel 文件
+    with stage(profiler, '生成报表'):
+        df2 = dp.generate_description_df()
+        excel_file = to_excel(sheets['物料'], sheets['成品'], df2, sheets['半成品'], df5=result['summary'],
+                              df6=result['delta'], profiler=profiler)
+    job.report("报表已生成", 1.0)
+    report_cache.put(report_key, excel_file)
+    return {'report_key': report_key, 'messages': messages, 'profile': profiler}
+
+def summary_key(report_key, name='汇总'):
+    return filecache.make_fingerprint(report_key, name)
+
+def load_cached_summary(report_key, name='汇总'):
+    data = get_report_cache().get(summary_key(report_key, name))
+    return filecache.frame_from_bytes(data) if data is not None else None
+
+def attach_job(job):
+    # 记录当前任务编号，页面链接中带上任务编号，刷新或重新打开链接后可取回结果
+    st.session_state.job_id = job.id
+    st.query_params["job"] = job.id
+
+def set_result(excel_file=None, export_path=None):
+    # 下载内容：Excel 报表字节流，或磁盘上的 zip 文件路径
+    st.session_state.pop('excel_file', None)
+    st.session_state.pop('export_path', None)
+    if excel_file is not None:
+        st.session_state.excel_file = excel_file
+    if export_path is not None:
+        st.session_state.export_path = export_path
+
+def collect_job(job):
+    # 已完成任务的结果写入会话状态（每个任务只写入一次）
+    # 报表、汇总及变动明细按任务结果中的缓存键从报表缓存读取
+    if job.status == jobs.DONE and st.session_state.get('collected_job') != job.id:
+        report_key = job.result['report_key']
+        export_path = job.result.get('export_path')
+        excel_file = get_report_cache().get(report_key) if export_path is None else None
+        set_result(excel_file=excel_file, export_path=export_path)
+        st.session_state.summary = load_cached_summary(report_key)
+        st.session_state.delta = load_cached_summary(report_key, '变动明细')
+        st.session_state.profile = job.result['profile']
+        st.session_state.messages = list(job.result['messages'])
+        if export_path is None and excel_file is None:
+            st.session_state.messages.append("报表已超出缓存有效期，请重新处理")
+        st.session_state.collected_job = job.id
+
+# 任务执行期间每秒刷新进度，任务结束后刷新整个页面以显示下载按钮
+@st.fragment(run_every=1.0)
+def show_job_progress(job_id):
+    job = get_job_runner().get(job_id)
+    if job is None or job.done:
+        st.rerun()
+    st.progress(job.progress, text=f"{job.status}：{job.message}")
+    if job.cancel_requested:
+        st.caption("正在取消...")
+    elif st.button("取消处理", key="cancel_job"):
+        job.cancel()
 
 # 页面设置
 st.set_page_config(page_title="数据处理工具", page_icon=":material/home:", layout='centered')
@@ -224,100 +189,99 @@ st.set_page_config(page_title="数据处理工具", page_icon=":material/home:",
 with st.container(border=True):
     st.header('每月物料库存数据处理', divider="rainbow")
     st.subheader('月末日期选择', divider='grey')
-    def get_last_day_of_previous_month():
-        today = date.today()
-        if today.month == 1:
-            year = today.year - 1
-            month = 12
-        else:
-            year = today.year
-            month = today.month - 1
-        _, last_day = calendar.monthrange(year, month)
-        return date(year, month, last_day)
-    
     # 默认日期为上月最后一天
-    default_date = get_last_day_of_previous_month()
+    default_date = monthly.last_day_of_previous_month()
     # 日期输入控件
     date_value = st.date_input(label="请选择日期,(默认为上月的最后一天)", value=default_date)
     # st.write(date_value)
     st.subheader('数据文件上传', divider='grey')
     # 多文件上传
     uploaded_files = st.file_uploader(label="1.请上传库存数据文件(.xlsx格式)", accept_multiple_files=True, type=["xlsx"])
-    upload_old_file = st.file_uploader(label="2.请上传上月处理结果(.xlsx格式)", accept_multiple_files=False, type=["xlsx"])
+    upload_old_file = st.file_uploader(label="2.请上传上月处理结果(.xlsx格式，未上传时使用历史记录)", accept_multiple_files=False, type=["xlsx"])
+    # 历史库中本月之前最近的月份
+    history_month = get_history_store().latest_month_before(history.month_of(date_value))
+    # 按链接中的任务编号重新关联之前提交的任务
+    if 'job_id' not in st.session_state and "job" in st.query_params:
+        st.session_state.job_id = st.query_params["job"]
+    current_job = get_job_runner().get(st.session_state.job_id) if 'job_id' in st.session_state else None
+    if current_job is not None:
+        collect_job(current_job)
+    # 明细行数较多时可导出为 zip（Excel 按行数拆分为多个文件，可附带 CSV/Parquet 明细）
+    export_mode = st.radio("导出方式", list(EXPORT_MODES), horizontal=True)
     col1, col2 = st.columns(2)
     
     with col1:
         if st.button(label="数据处理", type="primary", key="data_process"):
-            if uploaded_files and upload_old_file:
-                # 读取文件并缓存
-                dfs = load_excel_files(uploaded_files)
-                columns_to_keep = st.secrets["warehouses"]["columns_to_keep"]
-                # 并行处理数据
-                with concurrent.futures.ThreadPoolExecutor() as executor:
-                    df_lst = list(executor.map(lambda df: df.dropna(subset=["生产日期", "失效日期"], inplace=False)[columns_to_keep], dfs.values()))
-                df_all = pd.concat(df_lst, axis=0)
-                # 定义正则表达式，匹配字母和数字字符
-                pattern = re.compile(r'^([^:]+):')
-                # 使用正则表达式提取仓库代码并创建新列
-                df_all['仓库代码'] = df_all['仓库'].apply(lambda x: pattern.match(x).group(1) if pattern.match(x) else None)
-                # 数据处理--物料
-                wl = st.secrets["warehouses"]["wl"]
-                cp_wx = st.secrets["warehouses"]["cp_wx"]
-                df_wl1 = dp.warehouse_filtering(df_all,wl) # 筛选仓库
-                df_wl1 = dp.calculate_expiry(df_wl1, date_value) # 效期计算
-                df_wl1 = dp.expiry_classification(df_wl1) # 效期类别
-                df_wl1 = dp.receive_classification(df_wl1,date_value) # 领用时间分类
-                df_wl1 = dp.storage_days_classification(df_wl1,cp_wx) # 在库时间分类
-                df_wl1 = df_wl1[~((df_wl1['效期类别'] == '' ) & (df_wl1['90天内无领用'] == '' ) & (df_wl1['异常在库天数'] == ''))]
-                df_wl1 = dp.classify_items(df_wl1)
-                df_wl1['处理方案'] =''
-                df_wl1 = dp.sort_and_filter(df_wl1)
-                df_old_wl = pd.read_excel(upload_old_file, sheet_name='物料')
-                # TODO df_wl1 匹配上月处理方案
-                df_wl1 = dp.add_old_solution(df_wl1, df_old_wl)
-                # 数据处理-成品
-                cp = st.secrets["warehouses"]["cp_warehouses"]
-                cp_filter = st.secrets["warehouses"]["cp"]
-                df_cp1 = dp.cp_warehouse_filtering(df_all,cp,cp_filter)
-                df_cp1 = dp.calculate_expiry(df_cp1, date_value) # 效期计算
-                df_cp1 = dp.expiry_classification(df_cp1) # 效期类别
-                df_cp1 = dp.receive_classification(df_cp1,date_value) # 领用时间分类
-                df_cp1 = dp.storage_days_classification(df_cp1,cp_wx) # 在库时间分类
-                df_cp1 = df_cp1[~((df_cp1['效期类别'] == '' ) & (df_cp1['90天内无领用'] == '' ) & (df_cp1['异常在库天数'] == ''))]
-                df_cp1 = dp.classify_items(df_cp1)
-                df_cp1['处理方案'] =''
-                # 重新对列排序
-                df_cp1 = dp.sort_and_filter(df_cp1)
-                df_old_cp = pd.read_excel(upload_old_file, sheet_name='成品')
-                # TODO df_cp1 匹配上月处理方案
-                df_cp1 = dp.add_old_solution(df_cp1,df_old_cp)
-                # st.write(df_all.shape)
-                # st.data_editor(df_wl1)
-
-                # 数据处理-半产品
-                df4 = dp.getWipInventoryDays(df_all, date_value)
-                df_inventory = pd.ExcelFile(upload_old_file)
-                all_sheet_names = df_inventory.sheet_names  # 获取所有sheet名称列表
-                #  定义目标工作表名称
-                target_sheet = "半成品"
-                # 分情况读取或创建空DataFrame
-                if target_sheet in all_sheet_names:
-                    df_old_wip = pd.read_excel(upload_old_file, sheet_name=target_sheet)
+            export_zip, table_format = EXPORT_MODES[export_mode]
+            if uploaded_files and (upload_old_file or history_month):
+                # 相同输入（上传文件、日期、仓库配置）的报表直接从缓存读取
+                report_key = filecache.make_fingerprint(
+                    *[uploaded_file.getvalue() for uploaded_file in uploaded_files],
+                    upload_old_file.getvalue() if upload_old_file else get_history_store().run_info(history_month),
+                    date_value,
+                    dict(st.secrets["warehouses"]),
+                    report.REPORT_VERSION,
+                    date.today().strftime('%Y-%m')  # 说明页中的库存调取时间按当月生成
+                )
+                profiler = Profiler()
+                excel_file = None
+                if not export_zip:
+                    with profiler.stage('读取报表缓存'):
+                        excel_file = get_report_cache().get(report_key)
+                if excel_file is not None:
+                    set_result(excel_file=excel_file)
+                    st.session_state.summary = load_cached_summary(report_key)
+                    st.session_state.delta = load_cached_summary(report_key, '变动明细')
+                    st.session_state.profile = profiler
+                    st.session_state.messages = ["相同输入的报表已生成过，直接使用缓存结果"]
+                    st.session_state.input_warnings = []
+                elif current_job is not None and not current_job.done:
+                    st.info("当前任务尚未结束，请等待完成或取消后再提交")
                 else:
-                    # 情况2：不存在目标工作表，创建空DataFrame
-                    # 方案A：创建与df_cp1列结构一致的空DataFrame（推荐，避免后续匹配报错）
-                    df_old_wip = df4.iloc[0:0].copy()  # 取df_cp1的列名，行数为0，保留列结构
-                    
-                df4 = dp.add_old_solution(df4, df_old_wip)
-
-                # 生成 Excel 文件
-                df2 = dp.generate_description_df()
-                excel_file = to_excel(df_wl1,df_cp1,df2,df4)
-                st.session_state.excel_file = excel_file
+                    sources = [(uploaded_file.name, uploaded_file.getvalue()) for uploaded_file in uploaded_files]
+                    old_data = upload_old_file.getvalue() if upload_old_file else None
+                    # 只读取表头检查输入，有问题时一次列出全部问题，不提交任务
+                    problems, st.session_state.input_warnings = monthly.check_inputs(
+                        sources, dict(st.secrets["warehouses"]), old_data)
+                    if problems:
+                        st.error("输入检查未通过：\n\n" + "\n".join(f"- {problem}" for problem in problems))
+                    else:
+                        export_options = None
+                        if export_zip:
+                            settings = export_settings()
+                            export.cleanup_exports(settings['dir'], settings['max_age'])
+                            export_options = {'path': export.new_export_path(settings['dir']), 'table_format': table_format,
+                                              'rows_per_file': settings['rows_per_file']}
+                        # 提交后台任务；上传文件的内容在页面线程中读取，任务中不调用页面元素
+                        current_job = get_job_runner().submit(
+                            process_uploads,
+                            sources,
+                            old_data,
+                            date_value,
+                            dict(st.secrets["warehouses"]),
+                            st.secrets.get("loader", {}).get("max_workers"),
+                            get_upload_cache(),
+                            get_history_store(),
+                            get_report_cache(),
+                            report_key,
+                            export_options,
+                            name=f"{date_value} 月末库存处理"
+                        )
+                        attach_job(current_job)
             else:
                 st.info("请先上传数据文件!")
     with col2:
-        if 'excel_file' in st.session_state:
+        if 'export_path' in st.session_state and os.path.exists(st.session_state.export_path):
+            # 直接从磁盘文件读取下载内容
+            with open(st.session_state.export_path, 'rb') as export_file:
+                st.download_button(
+                    label="下载文件",
+                    data=export_file,
+                    type="primary",
+                    file_name="月末库存呆滞情况.zip",
+                    mime="application/zip"
+                )
+        elif 'excel_file' in st.session_state:
             st.download_button(
                 label="下载文件",
                 data=st.session_state.excel_file,
@@ -326,4 +290,92 @@ with st.container(border=True):
                 mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
             )
         else:
-            st.info("请先上传数据并进行数据处理。")
\ No newline at end of file
+            st.info("请先上传数据并进行数据处理。")
+    # 后台任务进度及结果
+    if current_job is not None:
+        if not current_job.done:
+            show_job_progress(current_job.id)
+        elif current_job.status == jobs.FAILED:
+            st.error(f"处理失败：{current_job.error}")
+            with st.expander("错误详情"):
+                st.code(current_job.traceback)
+        elif current_job.status == jobs.CANCELLED:
+            st.warning("处理已取消")
+        st.caption(f"任务编号：{current_job.id}（{current_job.status}），刷新页面后可通过当前链接取回结果")
+    elif 'job_id' in st.session_state:
+        st.caption("任务不存在或已过期，请重新处理")
+    for warning in st.session_state.get('input_warnings', []):
+        st.warning(warning)
+    for message in st.session_state.get('messages', []):
+        st.caption(message)
+    # 分类汇总（分类 × 所属组织 × 仓库代码），与报表中的“汇总”工作表相同
+    if st.session_state.get('summary') is not None:
+        with st.expander("分类汇总"):
+            summary = st.session_state.summary
+            st.dataframe(summary.assign(行数占比=summary['行数占比'] * 100, 现有量占比=summary['现有量占比'] * 100),
+                         hide_index=True,
+                         column_config={"现有量(主)": st.column_config.NumberColumn(format="%.2f"),
+                                        "行数占比": st.column_config.NumberColumn(format="%.2f%%"),
+                                        "现有量占比": st.column_config.NumberColumn(format="%.2f%%")})
+    # 与上月相比新增、已解除及类别变动的批次，与报表中的“变动明细”工作表相同
+    if st.session_state.get('delta') is not None:
+        delta = st.session_state.delta
+        with st.expander(f"本月变动（{len(delta)} 个批次）"):
+            if delta.empty:
+                st.caption("与上月相比没有新增、已解除或类别变动的批次（或上月结果中没有分类）")
+            else:
+                counts = delta.groupby(['工作表', '变动类型'], sort=False).agg(批次数=('物料编码', 'size'),
+                                                                         现有量变动=('现有量变动', 'sum'))
+                st.dataframe(counts, column_config={"现有量变动": st.column_config.NumberColumn(format="%.2f")})
+                st.dataframe(delta, hide_index=True,
+                             column_config={name: st.column_config.NumberColumn(format="%.2f")
+                                            for name in ['上月现有量', '本月现有量', '现有量变动']})
+    # 多日期情景分析：同一批库存按 月末日期 + 偏移天数 分类，比较各分类行数及现有量的变化
+    with st.expander("多日期情景分析"):
+        offsets = st.multiselect("分析日期", options=[0, 30, 60, 90], default=[0, 30, 60],
+                                 format_func=lambda days: "月末日期" if days == 0 else f"月末日期 +{days} 天")
+        if st.button("情景分析", key="scenario"):
+            if uploaded_files and offsets:
+                sources = [(uploaded_file.name, uploaded_file.getvalue()) for uploaded_file in uploaded_files]
+                problems, _ = monthly.check_inputs(sources, dict(st.secrets["warehouses"]))
+                if problems:
+                    st.error("输入检查未通过：\n\n" + "\n".join(f"- {problem}" for problem in problems))
+                else:
+                    with st.spinner("情景分析中..."):
+                        st.session_state.scenarios = monthly.process_scenarios(
+                            sources, date_value, offsets, st.secrets["warehouses"], cache=get_upload_cache(),
+                            max_workers=st.secrets.get("loader", {}).get("max_workers"))
+            else:
+                st.info("请先上传数据文件并选择分析日期!")
+        if 'scenarios' in st.session_state:
+            scenarios = st.session_state.scenarios
+            st.caption("各分类行数")
+            st.dataframe(dp.scenario_pivot(scenarios['汇总'], values='行数'))
+            st.caption("各分类现有量(主)")
+            st.dataframe(dp.scenario_pivot(scenarios['汇总'], values='现有量(主)'))
+            st.download_button(
+                label="下载明细(CSV)",
+                data=scenarios['明细'].to_csv(index=False).encode('utf-8-sig'),
+                file_name="多日期情景分析明细.csv",
+                mime="text/csv"
+            )
+    # 最近一次处理的各阶段记录
+    if 'profile' in st.session_state:
+        profiler = st.session_state.profile
+        with st.expander(f"处理耗时明细（合计 {profiler.total_seconds():.2f} 秒）"):
+            st.dataframe(profiler.to_frame(), hide_index=True,
+                         column_config={"耗时(秒)": st.column_config.NumberColumn(format="%.3f"),
+                                        "峰值内存(MB)": st.column_config.NumberColumn(format="%.1f"),
+                                        "内存增量(MB)": st.column_config.NumberColumn(format="%+.1f"),
+                                        "子进程峰值内存(MB)": st.column_config.NumberColumn(format="%.1f")})
+            st.download_button(
+                label="导出 JSON",
+                data=profiler.to_json(),
+                file_name="处理耗时明细.json",
+                mime="application/json"
+            )
+    # 历史记录：最近各月各分类的行数
+    history_summary = get_history_store().summary()
+    if not history_summary.empty:
+        with st.expander("历史记录（最近12个月各分类行数）"):
+            st.dataframe(history_summary, hide_index=True)
@@ -0,0 +1,249 @@
+# 性能基准：生成模拟的 EBS 现有量/可用量导出文件，分阶段计时，结果保存为 JSON 以便不同版本间对比
+# 示例：python benchmark.py --rows 10000 100000 --files 3 --output bench.json --compare bench_old.json
+import os
+import sys
+import json
+import time
+import itertools
+import platform
+import argparse
+import subprocess
+from io import BytesIO
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+import dataprocess as dp
+import loader
+import report
+
+# 模拟导出文件的表头（含不需要保留的列，用于检验列筛选）
+HEADERS = ['所属组织', '物料编码', '物料说明', '仓库', '货位', '批次', '现有量(主)', '可用量(主)', '单位(主)',
+           '生产日期', '失效日期', '在库天数', '最近事务处理时间', '物料类型', '备注']
+ORGANIZATIONS = ['JKYZ00', 'JKCP', 'JKRH00']
+WAREHOUSES = {
+    'XB03': '半成品仓', 'XB1': '半成品一仓', 'B1': '包材仓', 'EP': '外购品仓', 'RNB': '日化半成品仓',
+    'JKRHB': '日化半成品库', 'YL01': '原料仓', 'BC01': '包材仓', 'FL01': '辅料仓', 'CP01': '成品仓',
+    'CP02': '成品二仓', 'WX01': '外协成品仓', 'WX02': '外协原料仓', 'DJ01': '待检仓',
+}
+# 与模拟数据对应的仓库配置（格式同 secrets.toml 中的 [warehouses]）
+CONFIG = {
+    'columns_to_keep': ['所属组织', '物料编码', '物料说明', '仓库', '批次', '现有量(主)', '单位(主)',
+                        '生产日期', '失效日期', '在库天数', '最近事务处理时间'],
+    'wl': ['YL01', 'BC01', 'FL01', 'WX02'],
+    'cp_wx': ['WX01', 'WX02'],
+    'cp_warehouses': ['CP02'],
+    'cp': ['CP01', 'CP02', 'WX01'],
+}
+DATE_VALUE = datetime(2025, 9, 30).date()
+
+
+def generate_export(path, rows, seed=0, organization='JKYZ00'):
+    # 生成一个模拟导出文件：前 17 行为报表说明，第 18 行为表头
+    rng = np.random.default_rng(seed)
+    base = np.datetime64('2023-01-01')
+    produced = base + rng.integers(0, 1000, rows).astype('timedelta64[D]')
+    shelf_life = rng.choice([180, 365, 540, 730, 1095], rows).astype('timedelta64[D]')
+    expires = produced + shelf_life
+    last_used = base + rng.integers(0, 1000, rows).astype('timedelta64[D]') + rng.integers(0, 86400, rows).astype('timedelta64[s]')
+    codes = rng.choice(list(WAREHOUSES), rows)
+    materials = rng.integers(1, max(rows // 20, 10), rows)
+    batches = rng.integers(20230101, 20251231, rows)
+    quantities = np.round(rng.gamma(2.0, 300.0, rows), 3)
+    units = rng.choice(['KG', 'EA', '箱', 'PCS', 'L'], rows)
+    storage_days = rng.integers(0, 600, rows)
+    missing_dates = rng.random(rows) < 0.02
+    numeric_batches = rng.random(rows) < 0.3
+
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet('现有量可用量查询')
+    worksheet.append(['CUX.现有量/可用量查询'])
+    for i in range(1, 17):
+        worksheet.append([f'参数{i}', f'值{i}'] if i % 4 else [])
+    worksheet.append(HEADERS)
+    produced_text = np.datetime_as_string(produced, unit='D')
+    expires_text = np.datetime_as_string(expires, unit='D')
+    last_used_text = np.char.replace(np.datetime_as_string(last_used, unit='s'), 'T', ' ')
+    for i in range(rows):
+        code = codes[i]
+        worksheet.append([
+            organization, f'M{materials[i]:07d}', f'物料说明{materials[i] % 997}', f'{code}:{WAREHOUSES[code]}',
+            f'{code}-{i % 50:02d}', int(batches[i]) if numeric_batches[i] else f'{batches[i]}',
+            float(quantities[i]), float(quantities[i]), units[i],
+            None if missing_dates[i] else produced_text[i], None if missing_dates[i] else expires_text[i],
+            int(storage_days[i]), last_used_text[i], '原材料', None,
+        ])
+    workbook.save(path)
+
+
+def prepare_data(data_dir, rows, files):
+    # 模拟文件按 行数/文件序号 缓存在 data_dir 中，重复运行时直接复用
+    os.makedirs(data_dir, exist_ok=True)
+    paths = []
+    for i in range(files):
+        path = os.path.join(data_dir, f'export_{rows}_{i}.xlsx')
+        if not os.path.exists(path):
+            generate_export(path, rows // files, seed=i, organization=ORGANIZATIONS[i % len(ORGANIZATIONS)])
+        paths.append(path)
+    return paths
+
+
+def classify_items_apply(df):
+    # 向量化之前的逐行分类（原 dataprocess.classify_items），作为对照基准
+    df = df.copy()
+    df.loc[:, '分类'] = ""
+    def assign_classification(row):
+        classification = []
+        if row['效期类别'] == '过效期':
+            classification.append('过期货')
+        elif row['90天内无领用'] == '90天内无领用':
+            classification.append('呆滞品1')
+        elif row['异常在库天数'] == '≥180天':
+            classification.append('呆滞品2')
+        elif row['异常在库天数'] == '≥30天':
+            classification.append('呆滞品3')
+        elif row['效期类别'] == '剩余1/3效期' and row['90天内无领用'] =="" and row['异常在库天数'] =="" :
+            classification.append('临期货')
+        elif row['效期类别'] == '剩余2/3效期' and row['90天内无领用'] =="" and row['异常在库天数'] =="":
+            classification.append('预警货')
+        return ', '.join(classification)
+    df.loc[:, '分类'] = df.apply(assign_classification, axis=1)
+    return df
+
+
+def check_classification_parity():
+    # 三个标记列所有取值组合（含 None）下，dp.classify_items 与逐行分类结果一致；文本列及 category 列各检查一次
+    combinations = list(itertools.product(dp.EXPIRY_LABELS + [None], dp.RECEIVE_LABELS + [None], dp.STORAGE_LABELS + [None]))
+    df = pd.DataFrame(combinations, columns=['效期类别', '90天内无领用', '异常在库天数'], dtype=object)
+    expected = classify_items_apply(df)['分类'].to_numpy(dtype=object)
+    for frame in (df, df.astype('category')):
+        result = np.asarray(dp.classify_items(frame)['分类'], dtype=object)
+        mismatched = np.flatnonzero(result != expected)
+        if len(mismatched):
+            raise AssertionError(f'分类结果与逐行分类不一致：\n{frame.iloc[mismatched].assign(逐行=expected[mismatched], 向量化=result[mismatched])}')
+    return len(combinations)
+
+
+def timed(timings, name, repeat, func, *args, **kwargs):
+    # 取多次运行中的最短耗时
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    timings[name] = best
+    return result
+
+
+def run_benchmark(paths, repeat=1, max_workers=1):
+    timings = {}
+    sources = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            sources.append((os.path.basename(path), f.read()))
+    columns = CONFIG['columns_to_keep']
+
+    # 读取
+    dfs = timed(timings, 'load_excel_files', repeat, loader.load_inventory_files,
+                sources, columns=columns, max_workers=max_workers)
+    timed(timings, 'load_excel_files(read_excel)', repeat, loader.load_inventory_files,
+          sources, columns=columns, chunk_size=None, max_workers=max_workers)
+    df_all = pd.concat(dfs.values(), axis=0)
+    timed(timings, '仓库代码提取', repeat, dp.add_warehouse_code, df_all.drop(columns='仓库代码'))
+    object_bytes = int(df_all.memory_usage(deep=True).sum())
+    df_all = timed(timings, 'normalize_inventory', repeat, dp.normalize_inventory, df_all)
+
+    # 各数据处理函数
+    df = timed(timings, 'warehouse_filtering', repeat, dp.warehouse_filtering, df_all, CONFIG['wl'])
+    df = timed(timings, 'calculate_expiry', repeat, dp.calculate_expiry, df, DATE_VALUE)
+    df = timed(timings, 'expiry_classification', repeat, dp.expiry_classification, df)
+    df = timed(timings, 'receive_classification', repeat, dp.receive_classification, df, DATE_VALUE)
+    df = timed(timings, 'storage_days_classification', repeat, dp.storage_days_classification, df, CONFIG['cp_wx'])
+    df = df[~((df['效期类别'] == '') & (df['90天内无领用'] == '') & (df['异常在库天数'] == ''))]
+    timed(timings, 'classify_items(apply)', repeat, classify_items_apply, df)
+    df = timed(timings, 'classify_items', repeat, dp.classify_items, df)
+    timed(timings, 'sort_and_filter', repeat, lambda d: dp.sort_and_filter(d.assign(处理方案='')), df)
+    timed(timings, 'getWipInventoryDays', repeat, dp.getWipInventoryDays, df_all, DATE_VALUE)
+    routes = dp.WarehouseRoutes.from_config(CONFIG)
+    timed(timings, 'route_flags', repeat, routes.masks, df_all)
+    sheets = timed(timings, 'run_pipeline', repeat, dp.run_pipeline, df_all, DATE_VALUE, routes)
+
+    # 上月处理方案匹配：以本月结果模拟上月结果，每三行填写一个处理方案
+    for sheet_name in ('物料', '成品', '半成品'):
+        df_old = sheets[sheet_name].copy()
+        df_old['处理方案'] = np.where(np.arange(len(df_old)) % 3 == 0, '报废', None)
+        sheets[sheet_name] = timed(timings, f'add_old_solution[{sheet_name}]', repeat,
+                                   lambda d, o: dp.add_old_solution(d.copy(), o), sheets[sheet_name], df_old)
+
+    # 分类汇总及生成报表
+    summary = timed(timings, 'summarize_sheets', repeat, dp.summarize_sheets, sheets)
+    df2 = dp.generate_description_df()
+    timed(timings, 'to_excel', repeat, report.write_report, BytesIO(),
+          sheets['物料'], sheets['成品'], df2, sheets['半成品'], df5=summary)
+    rows = {'df_all': len(df_all), 'df_all_bytes(object)': object_bytes,
+            'df_all_bytes': int(df_all.memory_usage(deep=True).sum()), '物料': len(sheets['物料']), '成品': len(sheets['成品']), '半成品': len(sheets['半成品'])}
+    return timings, rows
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    # 按 行数 + 阶段 对比两次结果，输出耗时比值（>1 表示变慢）
+    previous = {(r['rows'], name): seconds for r in baseline['results'] for name, seconds in r['timings'].items()}
+    lines = []
+    for result in results:
+        for name, seconds in result['timings'].items():
+            old = previous.get((result['rows'], name))
+            if old:
+                lines.append(f"{result['rows']:>9} {name:<32} {old:9.3f}s -> {seconds:9.3f}s  x{seconds / old:.2f}")
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='库存数据处理性能基准')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000], help='总行数，可指定多个（如 10000 2000000）')
+    parser.add_argument('--files', type=int, default=3, help='每组数据拆分的文件数（对应不同库存组织）')
+    parser.add_argument('--repeat', type=int, default=1, help='每个阶段重复次数，取最短耗时')
+    parser.add_argument('--workers', type=int, default=1, help='并行解析的进程数')
+    parser.add_argument('--data-dir', default='.bench_data', help='模拟数据文件目录')
+    parser.add_argument('--output', default='bench.json', help='结果 JSON 路径')
+    parser.add_argument('--compare', help='与之前的结果 JSON 对比')
+    args = parser.parse_args(argv)
+
+    print(f'分类一致性检查：{check_classification_parity()} 种标记组合与逐行分类一致')
+    results = []
+    for rows in args.rows:
+        paths = prepare_data(args.data_dir, rows, args.files)
+        timings, row_counts = run_benchmark(paths, repeat=args.repeat, max_workers=args.workers)
+        results.append({'rows': rows, 'files': args.files, 'row_counts': row_counts, 'timings': timings})
+        for name, seconds in timings.items():
+            print(f'{rows:>9} {name:<32} {seconds:9.3f}s')
+
+    output = {
+        'revision': git_revision(),
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(output, f, ensure_ascii=False, indent=2)
+    print(f'结果已保存：{args.output}')
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            print(compare(results, json.load(f)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,142 @@
+# 月末库存数据处理的命令行入口，可用于定时任务批量处理，无需启动 Streamlit
+# 示例：python cli.py 库存导出/ --date 2025-09-30 --config .streamlit/secrets.toml --output 月末库存呆滞情况.xlsx --timings
+import os
+import sys
+import argparse
+import tomllib
+from datetime import date
+import dataprocess as dp
+import export
+import filecache
+import history
+import monthly
+from profiling import Profiler
+
+
+def collect_sources(paths):
+    # 参数可以是 .xlsx 文件或目录（读取目录下所有 .xlsx 文件，按文件名排序）
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(os.path.join(path, name) for name in os.listdir(path)
+                                if name.endswith('.xlsx') and not name.startswith('~$')))
+        else:
+            files.append(path)
+    sources = []
+    for file in files:
+        with open(file, 'rb') as f:
+            sources.append((os.path.basename(file), f.read()))
+    return sources
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='每月物料库存数据处理')
+    parser.add_argument('inputs', nargs='+', help='库存数据文件(.xlsx)或所在目录')
+    parser.add_argument('--date', type=date.fromisoformat, default=monthly.last_day_of_previous_month(),
+                        help='月末日期 YYYY-MM-DD，默认为上月最后一天')
+    parser.add_argument('--config', default='.streamlit/secrets.toml', help='配置文件(TOML)，格式同 secrets.toml')
+    parser.add_argument('--output', default='月末库存呆滞情况.xlsx', help='报表输出路径')
+    parser.add_argument('--old', help='上月处理结果(.xlsx)，未指定时使用历史库记录')
+    parser.add_argument('--history', help='历史库路径，默认读取配置 [history] path')
+    parser.add_argument('--no-history', action='store_true', help='不读写历史库')
+    parser.add_argument('--no-cache', action='store_true', help='不使用文件解析缓存')
+    parser.add_argument('--workers', type=int, help='并行解析的进程数，默认读取配置 [loader] max_workers')
+    parser.add_argument('--zip', action='store_true', help='导出为 zip：明细超过 --rows-per-file 行时拆分为多个 Excel 文件')
+    parser.add_argument('--tables', choices=['csv', 'parquet'], help='zip 中另附各明细表的 CSV/Parquet 文件')
+    parser.add_argument('--rows-per-file', type=int, default=export.ROWS_PER_FILE, help='zip 导出时每个 Excel 文件的明细行数上限')
+    parser.add_argument('--timings', action='store_true', help='输出各阶段耗时、峰值内存、内存增量及行数')
+    parser.add_argument('--timings-json', help='各阶段记录另存为 JSON 文件')
+    parser.add_argument('--scenarios', type=int, nargs='+', metavar='DAYS',
+                        help='多日期情景分析：按 月末日期+偏移天数（如 0 30 60）分类并输出各分类行数及现有量，不生成报表')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with open(args.config, 'rb') as f:
+        config = tomllib.load(f)
+    cache_config = config.get('cache', {})
+    profiler = Profiler()
+
+    with profiler.stage('读取输入'):
+        sources = collect_sources(args.inputs)
+        old_data = None
+        if args.old:
+            with open(args.old, 'rb') as f:
+                old_data = f.read()
+    if not sources:
+        print('未找到库存数据文件', file=sys.stderr)
+        return 1
+    # 只读取表头检查输入，有问题时一次列出后退出，不做完整解析
+    problems, warnings = monthly.check_inputs(sources, config['warehouses'], old_data, profiler=profiler)
+    for warning in warnings:
+        print(f'提示：{warning}', file=sys.stderr)
+    if problems:
+        print('输入检查未通过：', file=sys.stderr)
+        for problem in problems:
+            print(f'  {problem}', file=sys.stderr)
+        return 1
+
+    store = None
+    if not args.no_history:
+        store = history.HistoryStore(args.history or config.get('history', {}).get('path', 'history/inventory_history.sqlite'))
+    cache = None
+    if not args.no_cache:
+        cache = filecache.ParquetCache(
+            cache_dir=cache_config.get('upload_dir', '.cache/uploads'),
+            max_bytes=int(cache_config.get('upload_max_mb', 512)) * 1024 * 1024
+        )
+    max_workers = args.workers or config.get('loader', {}).get('max_workers')
+
+    if args.scenarios:
+        scenarios = monthly.process_scenarios(sources, args.date, args.scenarios, config['warehouses'],
+                                              cache=cache, max_workers=max_workers, profiler=profiler)
+        for values in ('行数', '现有量(主)'):
+            print(f'各日期分类{values}：')
+            print(dp.scenario_pivot(scenarios['汇总'], values=values).to_string(float_format='{:.2f}'.format))
+        print_timings(args, profiler)
+        return 0
+
+    month = history.month_of(args.date)
+    old_results = monthly.resolve_old_results(store, month, old_data, profiler=profiler)
+    result = monthly.process_inventory(sources, args.date, config['warehouses'], old_results,
+                                       cache=cache, max_workers=max_workers, profiler=profiler)
+    sheets = result['sheets']
+    if store is not None:
+        with profiler.stage('保存历史记录'):
+            store.save_run(month, sheets)
+    output = args.output
+    if args.zip or args.tables:
+        if output.endswith('.xlsx'):
+            output = output[:-len('.xlsx')] + '.zip'
+        monthly.write_monthly_export(output, sheets, summary=result['summary'], delta=result['delta'],
+                                     table_format=args.tables, rows_per_file=args.rows_per_file, profiler=profiler)
+    else:
+        monthly.write_monthly_report(output, sheets, summary=result['summary'], delta=result['delta'], profiler=profiler)
+
+    for sheet_name, match_stats in result['match_stats'].items():
+        print(f"{sheet_name}：{match_stats['行数']} 行，上月处理方案匹配 {match_stats['匹配率']:.1%}")
+    delta = result['delta']
+    if not delta.empty:
+        counts = delta.groupby(['工作表', '变动类型'], sort=False).size()
+        print('与上月相比：' + '，'.join(f'{sheet_name}{delta_type} {count} 个批次'
+                                      for (sheet_name, delta_type), count in counts.items()))
+    if cache is not None:
+        print(f"文件解析缓存：命中 {cache.stats['hits']} 个，未命中 {cache.stats['misses']} 个")
+    print(f'报表已保存：{output}')
+    print_timings(args, profiler)
+    return 0
+
+
+def print_timings(args, profiler):
+    if args.timings:
+        timings = profiler.to_frame()
+        print(timings.to_string(index=False, float_format='{:.3f}'.format), file=sys.stderr)
+        print(f"合计 {profiler.total_seconds():.3f} 秒", file=sys.stderr)
+    if args.timings_json:
+        with open(args.timings_json, 'w', encoding='utf-8') as f:
+            f.write(profiler.to_json())
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,17 +1,99 @@
 # 数据处理函数封装功能
+import re
 import numpy as np
 import pandas as pd
 from datetime import datetime
 import warnings
+from collections import namedtuple
+from profiling import stage
 # 过滤 openpyxl 的所有 UserWarning 警告
 warnings.filterwarnings('ignore', category=UserWarning, module='openpyxl')
 
+# 半成品仓库代码（配置中未指定 wip 或 routes 时使用）
+WIP_WAREHOUSES = ['XB03', 'XB1', 'B1', 'EP', 'RNB', 'JKRHB']
+# 仓库路由标记位：所属工作表及外协（在库 ≥30 天即为异常）
+ROUTE_FLAGS = {'物料': 1, '成品': 2, '半成品': 4, '外协': 8}
+# 仓库字段形如 "XB03:..."，冒号前为仓库代码
+WAREHOUSE_CODE_PATTERN = re.compile(r'^([^:]+):')
+# 取值重复度高的文本列，合并后转换为 category 类型（按整数编码存储，筛选/排序按编码进行）
+CATEGORY_COLUMNS = ['所属组织', '物料编码', '仓库', '仓库代码', '单位(主)']
+# 标记列的取值，'' 表示未标记
+EXPIRY_LABELS = ['', '过效期', '剩余1/3效期', '剩余2/3效期']
+RECEIVE_LABELS = ['', '90天内无领用']
+STORAGE_LABELS = ['', '≥180天', '≥30天']
+# 日期列在读取后解析一次，之后保持 datetime64 直到写出报表
+DATE_COLUMNS = ['生产日期', '失效日期', '最近事务处理时间']
+# 依次尝试的日期格式，均不匹配时按 pandas 自动推断
+DATE_FORMATS = ['ISO8601', '%Y/%m/%d', '%Y/%m/%d %H:%M:%S']
 
-def calculate_expiry(df, date_value):
-    df = df.copy()
-    # 确保日期列是 datetime 类型
-    df['失效日期'] = pd.to_datetime(df['失效日期'])
-    df['生产日期'] = pd.to_datetime(df['生产日期'])
+
+def add_warehouse_code(df, copy=True):
+    if copy:
+        df = df.copy()
+    # 整列正则提取仓库代码，不匹配或非文本的值为空
+    df['仓库代码'] = df['仓库'].astype(object).str.extract(WAREHOUSE_CODE_PATTERN, expand=False)
+    return df
+
+
+def _parse_date_values(values):
+    for fmt in DATE_FORMATS:
+        try:
+            return pd.to_datetime(values, format=fmt)
+        except (ValueError, TypeError):
+            continue
+    return pd.to_datetime(values)
+
+
+def to_datetime(series):
+    # 已是 datetime64 的列直接返回；否则只解析去重后的取值（同一日期在各批次间大量重复）
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    codes, uniques = pd.factorize(series)
+    parsed = _parse_date_values(pd.Index(uniques, dtype=object))
+    values = parsed.take(codes, allow_fill=True, fill_value=pd.NaT)
+    return pd.Series(values, index=series.index, name=series.name)
+
+
+def parse_dates(df, columns=DATE_COLUMNS, copy=True):
+    if copy:
+        df = df.copy()
+    for col in columns:
+        if col in df.columns:
+            df[col] = to_datetime(df[col])
+    return df
+
+
+def to_category(df, columns=CATEGORY_COLUMNS, copy=True):
+    # 全部为文本的列转换为 category；混有数字等其他类型的列保持原样（如部分物料编码为数字）
+    if copy:
+        df = df.copy()
+    for col in columns:
+        if col in df.columns and df[col].dtype == object and pd.api.types.infer_dtype(df[col], skipna=True) == 'string':
+            df[col] = df[col].astype('category')
+    return df
+
+
+def normalize_inventory(df, copy=True):
+    # 合并后的库存数据规范化：补充仓库代码，解析日期列，文本列转换为 category
+    if copy:
+        df = df.copy()
+    if '仓库代码' not in df.columns:
+        df = add_warehouse_code(df, copy=False)
+    df = parse_dates(df, copy=False)
+    return to_category(df, copy=False)
+
+
+def _labels(codes, categories):
+    # 整数编码 -> category 标记列
+    return pd.Categorical.from_codes(np.asarray(codes, dtype=np.int8), categories=categories)
+
+
+def calculate_expiry(df, date_value, copy=True):
+    if copy:
+        df = df.copy()
+    # 确保日期列是 datetime 类型（读取时已解析的列不再重复解析）
+    df['失效日期'] = to_datetime(df['失效日期'])
+    df['生产日期'] = to_datetime(df['生产日期'])
     date_value = pd.to_datetime(date_value)
     # 计算效期（失效日期 - 生产日期）
     df.loc[:,'效期'] = (df['失效日期'] - df['生产日期']).dt.days
@@ -19,9 +101,9 @@ def calculate_expiry(df, date_value):
     df.loc[:,'剩余效期天数'] = (df['失效日期'] - date_value).dt.days
     # 计算效期占比（剩余效期 / 效期）
     df.loc[:,'%(剩余效期/总效期)'] = df['剩余效期天数'] / df['效期']
-    # 将 '失效日期' 和 '生产日期' 转换为字符串格式 "YYYY-MM-DD"
-    df.loc[:,'失效日期'] = df['失效日期'].dt.strftime('%Y-%m-%d')
-    df.loc[:,'生产日期'] = df['生产日期'].dt.strftime('%Y-%m-%d')
+    # '失效日期' 和 '生产日期' 只保留日期部分，显示格式由报表的单元格格式决定
+    df['失效日期'] = df['失效日期'].dt.normalize()
+    df['生产日期'] = df['生产日期'].dt.normalize()
     return df
 
 def warehouse_filtering(df,wl):
@@ -32,63 +114,156 @@ def cp_warehouse_filtering(df,cp,cp_filter):
     df_cp = df[df['仓库代码'].isin(cp_filter) & (~df['仓库代码'].isin(cp))]
     return df_cp
 
-def expiry_classification(df):
-    df = df.copy()
-    # 定义效期类别的条件
+# 仓库路由表：仓库代码 -> ROUTE_FLAGS 标记位之和，按 仓库代码 的 category 编码编译为查找数组，
+# 一次索引即得到每行的所属工作表及外协标记；新增仓库只需修改配置
+class WarehouseRoutes:
+    def __init__(self, routes):
+        self.routes = {str(code): int(flags) for code, flags in routes.items() if flags}
+        self._compiled = (None, None)
+
+    @classmethod
+    def from_config(cls, config):
+        # config 为 secrets 中的 [warehouses]：优先使用 [warehouses.routes]（仓库代码 = ["物料", "外协", ...]），
+        # 否则由 wl / cp / cp_warehouses / cp_wx / wip 列表生成（成品为 cp 中除 cp_warehouses 以外的仓库）
+        if 'routes' in config:
+            routes = {}
+            for code, names in config['routes'].items():
+                unknown = [name for name in names if name not in ROUTE_FLAGS]
+                if unknown:
+                    raise ValueError(f"仓库 {code} 的路由 {unknown} 无效，可选 {list(ROUTE_FLAGS)}")
+                routes[code] = sum(ROUTE_FLAGS[name] for name in set(names))
+            return cls(routes)
+        routes = {}
+        excluded = set(config.get('cp_warehouses', []))
+        members = {
+            '物料': config.get('wl', []),
+            '成品': [code for code in config.get('cp', []) if code not in excluded],
+            '半成品': config.get('wip', WIP_WAREHOUSES),
+            '外协': config.get('cp_wx', []),
+        }
+        for name, codes in members.items():
+            for code in codes:
+                routes[code] = routes.get(code, 0) | ROUTE_FLAGS[name]
+        return cls(routes)
+
+    def lookup(self, categories):
+        # 按 category 编码索引的标记数组；末尾多一个 0，对应缺失值的编码 -1
+        # 同一批数据的各次筛选共用同一 categories，只编译一次
+        compiled_categories, table = self._compiled
+        if compiled_categories is not categories:
+            table = np.zeros(len(categories) + 1, dtype=np.uint8)
+            table[:-1] = [self.routes.get(str(code), 0) for code in categories]
+            self._compiled = (categories, table)
+        return table
+
+    def flags(self, codes):
+        # codes 为 仓库代码 列，返回每行的标记位
+        if not isinstance(codes.dtype, pd.CategoricalDtype):
+            codes = codes.astype('category')
+        return self.lookup(codes.cat.categories)[codes.cat.codes.to_numpy()]
+
+    def masks(self, df):
+        # 各工作表及外协的布尔掩码；同一仓库可能同时属于多个表
+        flags = self.flags(df['仓库代码'])
+        return {name: (flags & flag) != 0 for name, flag in ROUTE_FLAGS.items()}
+
+def outsourced_mask(df, cp_wx):
+    # cp_wx 可以是外协仓库代码列表、WarehouseRoutes 路由表，或已按行计算好的布尔数组
+    if isinstance(cp_wx, np.ndarray):
+        return cp_wx
+    if isinstance(cp_wx, WarehouseRoutes):
+        return (cp_wx.flags(df['仓库代码']) & ROUTE_FLAGS['外协']) != 0
+    return df['仓库代码'].isin(cp_wx).to_numpy()
+
+# 以下 *_codes 函数只做数组运算，输入可以是一维（按行）或二维（行×日期）数组
+def expiry_codes(ratio):
+    # 效期占比 -> EXPIRY_LABELS 编码：过效期、剩余1/3效期、剩余2/3效期、空
     conditions = [
-        (df['%(剩余效期/总效期)'] <= 0),
-        (df['%(剩余效期/总效期)'] <= 1/3) & (df['%(剩余效期/总效期)'] > 0),
-        (df['%(剩余效期/总效期)'] > 1/3) & (df['%(剩余效期/总效期)'] <= 2/3),
-        (df['%(剩余效期/总效期)'] > 2/3)
+        (ratio <= 0),
+        (ratio <= 1/3) & (ratio > 0),
+        (ratio > 1/3) & (ratio <= 2/3),
+        (ratio > 2/3)
     ]
-    # 定义分类值
-    choices = ["过效期", "剩余1/3效期", "剩余2/3效期", ""]
-    # 使用 numpy 的 select 方法进行分类
-    df.loc[:,'效期类别'] = np.select(conditions, choices, default="")
+    return np.select(conditions, [1, 2, 3, 0], default=0)
+
+def receive_codes(idle_days):
+    # 距最近事务处理的天数 -> RECEIVE_LABELS 编码
+    return np.asarray(idle_days >= 90, dtype=np.int8)
+
+def storage_codes(is_cp_wx, storage_days):
+    # 外协仓库在库 ≥30 天、其余在库 ≥180 天 -> STORAGE_LABELS 编码
+    return np.where(is_cp_wx & (storage_days >= 30), 2, np.where(storage_days >= 180, 1, 0))
+
+def expiry_classification(df, copy=True):
+    if copy:
+        df = df.copy()
+    # 按效期占比分类（使用 numpy 的 select 方法）
+    df['效期类别'] = _labels(expiry_codes(df['%(剩余效期/总效期)'].to_numpy()), EXPIRY_LABELS)
     return df
 
-def receive_classification(df, date_value):
-    df = df.copy()
+def receive_classification(df, date_value, copy=True):
+    if copy:
+        df = df.copy()
     # 确保日期列是 datetime 类型
-    df['最近事务处理时间'] = pd.to_datetime(df['最近事务处理时间'])
+    df['最近事务处理时间'] = to_datetime(df['最近事务处理时间'])
     date_value = pd.to_datetime(date_value)
     # 计算最近事务处理时间与日期值的天数差
-    df.loc[:,'90天内无领用'] = (date_value - df['最近事务处理时间'] ).dt.days.apply(lambda x: "90天内无领用" if x >= 90 else "")
+    df['90天内无领用'] = _labels(receive_codes((date_value - df['最近事务处理时间']).dt.days), RECEIVE_LABELS)
     return df
 
-def storage_days_classification(df,cp_wx):
-    df = df.copy()
-    # 添加新列 '异常在库天数'
-    df.loc[:, '异常在库天数'] = np.where(
-    (df['仓库代码'].isin(cp_wx)) & (df['在库天数'] >= 30),
-    "≥30天",
-    np.where(df['在库天数'] >= 180, "≥180天", ""))
+def storage_days_classification(df,cp_wx, copy=True):
+    if copy:
+        df = df.copy()
+    # 添加新列 '异常在库天数'（STORAGE_LABELS 中的编码）
+    df['异常在库天数'] = _labels(storage_codes(outsourced_mask(df, cp_wx), df['在库天数'].to_numpy()),
+                           STORAGE_LABELS)
     return df
 
-def classify_items(df):
+# 分类规则表：按优先级从高到低排列，每条规则为 (分类, 匹配条件{列名: 取值}, 说明)
+# classify_items / sort_and_filter / generate_description_df 共用此表
+CLASSIFICATION_RULES = [
+    ('过期货', {'效期类别': '过效期'}, '以当前库存物料在库失效日期为准，超过失效日期物料'),
+    ('呆滞品1', {'90天内无领用': '90天内无领用'}, '物料调取维度：以最后一次事物处理时间为基础，筛选出90天内无领用物料'),
+    ('呆滞品2', {'异常在库天数': '≥180天'}, '物料调取维度：以当前库存在库时长≥180天物料'),
+    ('呆滞品3', {'异常在库天数': '≥30天'}, '外协单元存货调取维度：以当前库存在库时长≥30天(外协成品)'),
+    ('临期货', {'效期类别': '剩余1/3效期', '90天内无领用': '', '异常在库天数': ''}, '以当前库存物料在库失效日期为准，剩余三分之一效期物料'),
+    ('预警货', {'效期类别': '剩余2/3效期', '90天内无领用': '', '异常在库天数': ''}, '以当前库存物料在库失效日期为准，剩余三分之二效期物料'),
+]
+
+# 分类列的取值，编码 0 为未分类，i 为规则表第 i 条
+CLASSIFICATION_LABELS = [''] + [label for label, _, _ in CLASSIFICATION_RULES]
+
+# 标记列的整数编码及取值表，编码可以是二维（行×日期）数组
+Labels = namedtuple('Labels', ['codes', 'categories'])
+
+def _rule_condition(column, value):
+    # category 列（或 Labels）按整数编码比较，不逐个比较字符串
+    if isinstance(column, (pd.Categorical, Labels)):
+        code = pd.Index(column.categories).get_indexer([value])[0]
+        if code < 0:
+            return np.zeros(np.shape(column.codes), dtype=bool)
+        return column.codes == code
+    return np.asarray(column) == value
+
+def select_classification(columns):
+    # columns: {列名: 数组}，数组形状可广播（一维按行，或二维 行×日期），返回 CLASSIFICATION_LABELS 中的编码
+    conditions = []
+    for _, rule, _ in CLASSIFICATION_RULES:
+        condition = True
+        for col, value in rule.items():
+            condition = condition & _rule_condition(columns[col], value)
+        conditions.append(condition)
+    choices = list(range(1, len(CLASSIFICATION_RULES) + 1))
+    # np.select 按顺序取第一个满足的条件，即规则表中的优先级
+    return np.select(conditions, choices, default=0)
+
+def classify_items(df, copy=True):
     # 确保 DataFrame 是副本，避免 SettingWithCopyWarning
-    df = df.copy()
-    # 初始化新列 '分类' 为空字符串
-    df.loc[:, '分类'] = ""
-    # 定义各个条件的判断函数
-    def assign_classification(row):
-        classification = []
-        if row['效期类别'] == '过效期':
-            classification.append('过期货')
-        elif row['90天内无领用'] == '90天内无领用':
-            classification.append('呆滞品1')
-        elif row['异常在库天数'] == '≥180天':
-            classification.append('呆滞品2')
-        elif row['异常在库天数'] == '≥30天':
-            classification.append('呆滞品3')
-        elif row['效期类别'] == '剩余1/3效期' and row['90天内无领用'] =="" and row['异常在库天数'] =="" :
-            classification.append('临期货')
-        elif row['效期类别'] == '剩余2/3效期' and row['90天内无领用'] =="" and row['异常在库天数'] =="":
-            classification.append('预警货')
-        # 将分类结果用逗号隔开连接成字符串
-        return ', '.join(classification)
-    # 应用分类函数
-    df.loc[:, '分类'] = df.apply(assign_classification, axis=1)
+    if copy:
+        df = df.copy()
+    # 按规则表整列计算分类，替代逐行 apply
+    rule_columns = {col for _, rule, _ in CLASSIFICATION_RULES for col in rule}
+    df['分类'] = _labels(select_classification({col: df[col].array for col in rule_columns}), CLASSIFICATION_LABELS)
     return df
 
 def reorder_columns(df, columns_to_front):
@@ -112,14 +287,11 @@ def generate_description_df():
                     ['1.库存调取时间', '2024年12月30日 上午9点','优先级'],
                     ['2.库存组织', 'JKYZ00.健康牙膏智能制造中心   JKCP:健康产品公司   JKRH00.健康日化制造中心','--'],
                     ['3.库存数据来源', 'EBS库存：CUX.现有量/可用量查询（XML报表）','--'],
-                    ['4.过期货', '以当前库存物料在库失效日期为准，超过失效日期物料',1],
-                    ['5.呆滞品1', '物料调取维度：以最后一次事物处理时间为基础，筛选出90天内无领用物料',2],
-                    ['6.呆滞品2', '物料调取维度：以当前库存在库时长≥180天物料',3],
-                    ['7.呆滞品3', '外协单元存货调取维度：以当前库存在库时长≥30天(外协成品)',4],
-                    ['8.临期货', '以当前库存物料在库失效日期为准，剩余三分之一效期物料',5],
-                    ['9.预警货', '以当前库存物料在库失效日期为准，剩余三分之二效期物料',6],
-                    ['10.无系统账物料', '存放于经开区厂区仓库无系统账物料情况','']
                 ]
+    # 分类说明及优先级由分类规则表生成
+    for priority, (label, _, description) in enumerate(CLASSIFICATION_RULES, start=1):
+        data_list.append([f'{len(data_list)}.{label}', description, priority])
+    data_list.append([f'{len(data_list)}.无系统账物料', '存放于经开区厂区仓库无系统账物料情况',''])
     current_month_first_day = datetime.now().replace(day=1, hour=8, minute=30, second=0, microsecond=0)
     data_list[1][1] = current_month_first_day.strftime('%Y年%m月%d日 上午%I点%M分')
     df2 = pd.DataFrame(data_list)
@@ -127,7 +299,7 @@ def generate_description_df():
 
 
 def sort_and_filter(df):
-    category_order = ['过期货', '呆滞品1','呆滞品2','呆滞品3', '临期货', '预警货']
+    category_order = [label for label, _, _ in CLASSIFICATION_RULES]
     df['分类'] = pd.Categorical(df['分类'], categories=category_order, ordered=True)
     df = df.sort_values(by='分类')
     cols_to_keep = [
@@ -140,39 +312,176 @@ def sort_and_filter(df):
     df = reorder_columns(df, cols_to_keep)
     return df
 
+# 汇总表的分组列
+SUMMARY_KEYS = ['分类', '所属组织', '仓库代码']
+
+def summarize_sheet(df):
+    # 按 分类 × 所属组织 × 仓库代码 统计行数、现有量及其在本工作表中的占比（分类按优先级排列）
+    quantity = pd.to_numeric(df['现有量(主)'], errors='coerce')
+    grouped = df[SUMMARY_KEYS].assign(现有量=quantity).groupby(SUMMARY_KEYS, observed=True, sort=True, dropna=False)
+    summary = grouped['现有量'].agg(['size', 'sum']).reset_index()
+    summary.columns = SUMMARY_KEYS + ['行数', '现有量(主)']
+    summary['行数占比'] = summary['行数'] / len(df) if len(df) else 0.0
+    total = quantity.sum()
+    summary['现有量占比'] = summary['现有量(主)'] / total if total else 0.0
+    return summary
+
+def summarize_sheets(sheets, sheet_names=('物料', '成品')):
+    frames = []
+    for sheet_name in sheet_names:
+        summary = summarize_sheet(sheets[sheet_name])
+        summary.insert(0, '工作表', sheet_name)
+        frames.append(summary)
+    return pd.concat(frames, ignore_index=True)
+
+# 匹配上月处理方案所用的键
+SOLUTION_KEYS = ['物料编码', '批次', '仓库代码']
+
+def _normalize_key_value(value):
+    # 缺失值为空字符串；整数值的浮点数（Excel 读取后常见，如 20240101.0）按整数处理；文本去除首尾空格
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return ''
+    if isinstance(value, (float, np.floating)) and float(value).is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+def normalize_keys(df, keys=SOLUTION_KEYS):
+    # 将多列键规范化后拼接为单列字符串键，便于哈希匹配；每列只对去重后的取值做转换
+    joined = None
+    for col in keys:
+        codes, uniques = pd.factorize(df[col], use_na_sentinel=False)
+        normalized = np.array([_normalize_key_value(value) for value in uniques], dtype=object)
+        column = normalized[codes] if len(codes) else np.array([], dtype=object)
+        joined = column if joined is None else joined + '\x1f' + column
+    return pd.Index(joined, dtype=object)
+
+def has_solution(values):
+    # 非空且不全为空白的处理方案
+    values = pd.Series(np.asarray(values, dtype=object))
+    return (values.notna() & (values.astype(str).str.strip() != '')).to_numpy()
+
+def fill_solutions(df):
+    # 系统处理结果中 处理方案 为空（待人工填写）的行沿用其 上月处理方案，处理方案可延续过未经人工处理的月份
+    if '处理方案' not in df.columns or '上月处理方案' not in df.columns:
+        return df
+    df = df.copy()
+    blank = ~has_solution(df['处理方案'])
+    df.loc[blank, '处理方案'] = df.loc[blank, '上月处理方案']
+    return df
+
+def build_solution_index(df_old):
+    # 由上月结果构建 键 -> 处理方案 的唯一索引；上月结果没有 '处理方案' 列时返回 None
+    if '处理方案' not in df_old.columns:
+        return None
+    solutions = df_old['处理方案'].reset_index(drop=True)
+    keys = normalize_keys(df_old)
+    # 重复键：优先取第一条非空处理方案，均为空时取第一条
+    order = np.argsort(~has_solution(solutions), kind='stable')
+    index = pd.Series(solutions.to_numpy()[order], index=keys[order])
+    index = index[~index.index.duplicated(keep='first')]
+    index.attrs['重复键数'] = int(len(keys) - len(index))
+    return index
+
+def match_old_solution(df_new, solution_index):
+    # 按规范化后的键匹配上月处理方案，返回 (结果, 匹配统计)
+    stats = {'行数': len(df_new), '匹配行数': 0, '带方案行数': 0, '匹配率': 0.0, '上月重复键数': 0}
+    if solution_index is None:
+        # 上月结果无 '处理方案' 列，将 df_new 的 '处理方案' 列全部置空
+        df_new['处理方案'] = ''
+        return df_new, stats
+    positions = solution_index.index.get_indexer(normalize_keys(df_new))
+    found = positions >= 0
+    old_solutions = np.full(len(positions), np.nan, dtype=object)
+    old_solutions[found] = solution_index.to_numpy()[positions[found]]
+    df_new['上月处理方案'] = old_solutions
+    # 将新列移动到第 8 列的位置（索引7）
+    cols = list(df_new.columns)
+    cols.pop()
+    cols.insert(7, '上月处理方案')
+    df_new = df_new[cols]
+    stats['匹配行数'] = int(found.sum())
+    stats['带方案行数'] = int(has_solution(old_solutions).sum())
+    stats['匹配率'] = stats['匹配行数'] / len(df_new) if len(df_new) else 0.0
+    stats['上月重复键数'] = solution_index.attrs.get('重复键数', 0)
+    return df_new, stats
+
 def add_old_solution(df_new, df_old):
-    # 步骤 1: 判断 df_old 是否包含 '处理方案' 列
-    if '处理方案' in df_old.columns:
-        # 若存在该列，执行原有匹配逻辑
-        # 创建查找映射 (物料编码, 批次, 仓库代码) -> 处理方案
-        mapping_series = df_old.set_index(['物料编码', '批次', '仓库代码'])['处理方案']
-        # 在 df_new 中新增 '上月处理方案' 列并完成匹配
-        df_new['上月处理方案'] = df_new.set_index(['物料编码', '批次', '仓库代码']).index.map(mapping_series)
-        # 步骤 2: 将新列移动到第 8 列的位置（索引7）
-        cols = list(df_new.columns)
-        # 移除末尾的 '上月处理方案' 列
-        cols.pop()
-        # 插入到索引7的位置（对应第8列）
-        cols.insert(7, '上月处理方案')
-        # 重新排列列顺序
-        df_new = df_new[cols]
-    else:
-        # 若 df_old 不存在 '处理方案' 列，将 df_new 的 '处理方案' 列全部置空
-        # 先判断 df_new 是否已有 '处理方案' 列，避免报错
-        if '处理方案' in df_new.columns:
-            # 置空（可选择空字符串''或None，按需调整）
-            df_new['处理方案'] = ''  # 推荐空字符串，兼容性更强；若需None可改为 df_new['处理方案'] = None
-        else:
-            # 若 df_new 也没有该列，可选择创建并置空（可选，根据你的业务需求决定是否保留此段）
-            df_new['处理方案'] = ''
+    # df_old 可以是上月结果的 DataFrame，也可以是 build_solution_index 预先构建的索引
+    solution_index = build_solution_index(df_old) if isinstance(df_old, pd.DataFrame) else df_old
+    df_new, _ = match_old_solution(df_new, solution_index)
     return df_new
 
 
+
+# 本月与上月分类结果的变动对比（按 SOLUTION_KEYS 对应同一批次）
+DELTA_TYPES = ['新增', '已解除', '类别变动']
+DELTA_COLUMNS = ['工作表', '变动类型'] + SOLUTION_KEYS + ['物料说明', '上月分类', '本月分类',
+                                                      '上月现有量', '本月现有量', '现有量变动']
+# 对比所需的上月结果列
+DELTA_REQUIRED_COLUMNS = SOLUTION_KEYS + ['分类', '现有量(主)']
+
+def _lots(df):
+    # 同一批次（键）合并为一行：现有量求和，分类取优先级最高的一条（未分类的优先级最低）
+    ranks = pd.Categorical(np.asarray(df['分类'], dtype=object), categories=CLASSIFICATION_LABELS[1:]).codes
+    lots = pd.DataFrame({
+        '键': normalize_keys(df),
+        '优先级': np.where(ranks < 0, len(CLASSIFICATION_RULES), ranks),
+        '现有量': pd.to_numeric(df['现有量(主)'], errors='coerce').fillna(0).to_numpy(),
+        '物料说明': np.asarray(df['物料说明'], dtype=object) if '物料说明' in df.columns else None,
+    })
+    grouped = lots.groupby('键', sort=False)
+    return pd.DataFrame({'优先级': grouped['优先级'].min(), '现有量': grouped['现有量'].sum(),
+                         '物料说明': grouped['物料说明'].first()})
+
+def compare_sheet(df_new, df_old):
+    # 两个月的批次按键做一次哈希连接，返回 新增/已解除/类别变动 的批次及现有量变动（不含 工作表 列）
+    merged = _lots(df_new).join(_lots(df_old), how='outer', lsuffix='_本月', rsuffix='_上月')
+    in_new = merged['优先级_本月'].notna().to_numpy()
+    in_old = merged['优先级_上月'].notna().to_numpy()
+    reclassified = in_new & in_old & (merged['优先级_本月'] != merged['优先级_上月']).to_numpy()
+    delta_types = np.select([in_new & ~in_old, in_old & ~in_new, reclassified], [0, 1, 2], default=-1)
+    changed = merged[delta_types >= 0]
+    delta_types = delta_types[delta_types >= 0]
+    # 优先级 -> 分类名称，缺失（该月没有此批次）为空
+    labels = np.array(CLASSIFICATION_LABELS[1:] + [''] * 2, dtype=object)
+    new_ranks = changed['优先级_本月'].fillna(len(CLASSIFICATION_RULES) + 1).astype(int).to_numpy()
+    old_ranks = changed['优先级_上月'].fillna(len(CLASSIFICATION_RULES) + 1).astype(int).to_numpy()
+    new_quantity = changed['现有量_本月'].fillna(0).to_numpy()
+    old_quantity = changed['现有量_上月'].fillna(0).to_numpy()
+    delta = pd.DataFrame([key.split('\x1f') for key in changed.index], columns=SOLUTION_KEYS)
+    delta.insert(0, '变动类型', np.array(DELTA_TYPES, dtype=object)[delta_types])
+    delta['物料说明'] = changed['物料说明_本月'].combine_first(changed['物料说明_上月']).to_numpy()
+    delta['上月分类'] = labels[old_ranks]
+    delta['本月分类'] = labels[new_ranks]
+    delta['上月现有量'] = old_quantity
+    delta['本月现有量'] = new_quantity
+    delta['现有量变动'] = new_quantity - old_quantity
+    # 按 变动类型、分类优先级（已解除的按上月分类）、键 排序
+    ranks = np.where(delta_types == 1, old_ranks, new_ranks)
+    order = np.lexsort((delta['仓库代码'].to_numpy(), delta['批次'].to_numpy(), delta['物料编码'].to_numpy(),
+                        ranks, delta_types))
+    return delta.iloc[order].reset_index(drop=True)
+
+def compare_sheets(sheets, old_results, sheet_names=('物料', '成品')):
+    # 上月没有该工作表或缺少 DELTA_REQUIRED_COLUMNS 中的列时不做对比
+    frames = []
+    for sheet_name in sheet_names:
+        df_old = (old_results or {}).get(sheet_name)
+        if df_old is None or any(col not in df_old.columns for col in DELTA_REQUIRED_COLUMNS):
+            continue
+        delta = compare_sheet(sheets[sheet_name], df_old)
+        delta.insert(0, '工作表', sheet_name)
+        frames.append(delta)
+    if not frames:
+        return pd.DataFrame(columns=DELTA_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
 # 新增半产品在库天数
-def getWipInventoryDays(df_all, date_value):
-    WipInventory = ['XB03', 'XB1', 'B1', 'EP', 'RNB', 'JKRHB']
-    df_WipInventory = df_all[df_all['仓库代码'].isin(WipInventory)].copy()
-    df_WipInventory['生产日期'] = pd.to_datetime(df_WipInventory['生产日期'])
+def getWipInventoryDays(df_all, date_value, mask=None):
+    if mask is None:
+        mask = WarehouseRoutes({code: ROUTE_FLAGS['半成品'] for code in WIP_WAREHOUSES}).masks(df_all)['半成品']
+    df_WipInventory = df_all[mask].copy()
+    df_WipInventory['生产日期'] = to_datetime(df_WipInventory['生产日期'])
     date_value = pd.to_datetime(date_value)
     
     # 在第二列（loc=1）插入「处理方案」列
@@ -198,4 +507,107 @@ def getWipInventoryDays(df_all, date_value):
         inplace=True
     )
     
-    return df_WipInventory
\ No newline at end of file
+    return df_WipInventory
+
+
+def classify_inventory(df, date_value, cp_wx, copy=True, profiler=None):
+    # 在同一份副本上依次计算效期、领用、在库天数及分类，每个日期列只解析一次
+    if copy:
+        df = df.copy()
+    rows = len(df)
+    with stage(profiler, '效期计算', rows_in=rows):
+        df = calculate_expiry(df, date_value, copy=False)
+    with stage(profiler, '效期类别', rows_in=rows):
+        df = expiry_classification(df, copy=False)
+    with stage(profiler, '领用时间分类', rows_in=rows):
+        df = receive_classification(df, date_value, copy=False)
+    with stage(profiler, '在库时间分类', rows_in=rows):
+        df = storage_days_classification(df, cp_wx, copy=False)
+    with stage(profiler, '分类', rows_in=rows):
+        df = classify_items(df, copy=False)
+    return df
+
+def run_pipeline(df_all, date_value, routes, profiler=None):
+    # routes 为 WarehouseRoutes 路由表；单次计算所有派生列，各 Sheet 仅为对结果的掩码筛选
+    with stage(profiler, '仓库筛选', rows_in=len(df_all)) as record:
+        masks = routes.masks(df_all)
+        in_scope = masks['物料'] | masks['成品']
+        record['输出行数'] = int(in_scope.sum())
+    df = classify_inventory(df_all[in_scope], date_value, masks['外协'][in_scope], profiler=profiler)
+    # 三类标记均为空的行不输出
+    flagged = ~((df['效期类别'] == '') & (df['90天内无领用'] == '') & (df['异常在库天数'] == '')).to_numpy()
+    sheets = {}
+    for sheet_name in ('物料', '成品'):
+        with stage(profiler, f'排序筛选[{sheet_name}]', rows_in=len(df)) as record:
+            df_sheet = df[masks[sheet_name][in_scope] & flagged].assign(处理方案='')
+            sheets[sheet_name] = sort_and_filter(df_sheet)
+            record['输出行数'] = len(sheets[sheet_name])
+    with stage(profiler, '半成品在库天数', rows_in=len(df_all)) as record:
+        sheets['半成品'] = getWipInventoryDays(df_all, date_value, mask=masks['半成品'])
+        record['输出行数'] = len(sheets['半成品'])
+    return sheets
+
+
+# 多日期情景分析：同一批库存按多个日期分类，比较各分类的变化
+def _day_difference(later, earlier):
+    # datetime64 数组之差的整天数（向下取整，与 Series.dt.days 一致），NaT 为 NaN
+    delta = later - earlier
+    with np.errstate(invalid='ignore'):
+        days = (delta // np.timedelta64(1, 'D')).astype(float)
+    days[np.isnat(delta)] = np.nan
+    return days
+
+def classify_scenarios(df, date_values, cp_wx, base_date=None):
+    # 日期相关的天数按 行×日期 二维数组一次计算，返回与 df 行对应、每个日期一列的分类
+    # 在库天数视为 base_date（默认第一个日期）当天的天数，其他日期按相差的天数顺延
+    dates = pd.to_datetime(list(date_values)).to_numpy()
+    base = pd.Timestamp(base_date if base_date is not None else dates[0]).to_datetime64()
+    expiry = to_datetime(df['失效日期']).to_numpy()[:, None]
+    produced = to_datetime(df['生产日期']).to_numpy()[:, None]
+    last_used = to_datetime(df['最近事务处理时间']).to_numpy()[:, None]
+    shelf_life = _day_difference(expiry, produced)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = _day_difference(expiry, dates[None, :]) / shelf_life
+    idle_days = _day_difference(dates[None, :], last_used)
+    storage_days = df['在库天数'].to_numpy(dtype=float)[:, None] + _day_difference(dates, base)[None, :]
+    is_cp_wx = outsourced_mask(df, cp_wx)[:, None]
+    codes = select_classification({
+        '效期类别': Labels(expiry_codes(ratio), EXPIRY_LABELS),
+        '90天内无领用': Labels(receive_codes(idle_days), RECEIVE_LABELS),
+        '异常在库天数': Labels(storage_codes(is_cp_wx, storage_days), STORAGE_LABELS),
+    })
+    labels = [pd.Timestamp(d).strftime('%Y-%m-%d') for d in dates]
+    return pd.DataFrame({label: _labels(codes[:, i], CLASSIFICATION_LABELS) for i, label in enumerate(labels)},
+                        index=df.index)
+
+def run_scenarios(df_all, date_values, routes, base_date=None):
+    # 返回 {'明细': 各行在各日期的分类, '汇总': 工作表×日期×分类 的行数及现有量}
+    masks = routes.masks(df_all)
+    in_scope = masks['物料'] | masks['成品']
+    df = df_all[in_scope]
+    classes = classify_scenarios(df, date_values, masks['外协'][in_scope], base_date=base_date)
+    quantity = np.nan_to_num(pd.to_numeric(df['现有量(主)'], errors='coerce').to_numpy(dtype=float))
+    frames = []
+    for sheet_name in ('物料', '成品'):
+        rows = masks[sheet_name][in_scope]
+        for label in classes.columns:
+            codes = classes[label].cat.codes.to_numpy()[rows]
+            counts = np.bincount(codes, minlength=len(CLASSIFICATION_LABELS))
+            quantities = np.bincount(codes, weights=quantity[rows], minlength=len(CLASSIFICATION_LABELS))
+            frames.append(pd.DataFrame({'工作表': sheet_name, '日期': label, '分类': CLASSIFICATION_LABELS[1:],
+                                        '行数': counts[1:], '现有量(主)': quantities[1:]}))
+    summary = pd.concat(frames, ignore_index=True)
+    # 明细只保留至少在一个日期有分类的行
+    flagged = (classes != '').any(axis=1).to_numpy()
+    # 合并后的行号在各文件间重复，按位置对齐而不是按索引连接
+    detail = pd.concat([df.loc[flagged, ['物料编码', '物料说明', '批次', '仓库代码', '现有量(主)']].reset_index(drop=True),
+                        classes[flagged].reset_index(drop=True)], axis=1)
+    return {'明细': detail, '汇总': summary}
+
+def scenario_pivot(summary, values='行数'):
+    # 汇总表转为 (工作表, 分类) × 日期 的对照表，分类按规则表顺序排列
+    category_order = [label for label, _, _ in CLASSIFICATION_RULES]
+    table = summary.assign(分类=pd.Categorical(summary['分类'], categories=category_order, ordered=True))
+    table = table.pivot_table(index=['工作表', '分类'], columns='日期', values=values, aggfunc='sum', observed=True)
+    table.columns.name = None
+    return table.reindex(['物料', '成品'], level=0)
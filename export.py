@@ -0,0 +1,107 @@
+# 大报表导出：明细超过行数上限时拆分为多个 Excel 文件，可附带 CSV/Parquet 格式的明细，
+# 全部写入磁盘上的 zip 文件，下载时直接读取该文件，不在内存中保留整份报表
+import os
+import time
+import uuid
+import shutil
+import zipfile
+import tempfile
+import pandas as pd
+import dataprocess as dp
+import report
+from profiling import stage
+
+# 附带的明细表格式
+TABLE_FORMATS = ('csv', 'parquet')
+# 每个 Excel 文件中各明细工作表的默认行数上限
+ROWS_PER_FILE = 500000
+DETAIL_SHEETS = {'物料': '物料', '成品': '成品', '半成品': '半成品在库天数'}
+
+
+def _parquet_safe(df):
+    # Parquet 列必须为单一类型：混有数字和文本的列（如批次）按文本写出，缺失值保持为空
+    df = df.copy()
+    for col in df.columns[df.dtypes == object]:
+        if pd.api.types.infer_dtype(df[col], skipna=True) not in ('string', 'empty'):
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+    return df
+
+
+def write_table(path, df, table_format):
+    if table_format == 'csv':
+        # 带 BOM，Excel 直接打开时中文不乱码
+        df.to_csv(path, index=False, encoding='utf-8-sig', chunksize=report.WRITE_CHUNK_ROWS)
+    elif table_format == 'parquet':
+        _parquet_safe(df).to_parquet(path, index=False)
+    else:
+        raise ValueError(f"不支持的明细格式 '{table_format}'，可选 {TABLE_FORMATS}")
+
+
+def write_export(path, sheets, summary=None, delta=None, table_format=None, rows_per_file=ROWS_PER_FILE, profiler=None):
+    # 写出 zip 文件：月末库存呆滞情况.xlsx（明细超过 rows_per_file 行时拆分为 _1、_2... 多个文件，
+    # 每个文件含说明页，汇总及变动明细只写入第一个文件），table_format 指定时另附各明细工作表的 CSV/Parquet
+    if table_format is not None and table_format not in TABLE_FORMATS:
+        raise ValueError(f"不支持的明细格式 '{table_format}'，可选 {TABLE_FORMATS}")
+    df2 = dp.generate_description_df()
+    parts = {name: report.shard_frames(sheets[name], rows_per_file) for name in DETAIL_SHEETS}
+    n_files = max(len(frames) for frames in parts.values())
+    work_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(path)))
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        with zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            for index in range(n_files):
+                # 各明细在本文件中的分片；已写完的明细写出空表（保留表头）
+                frames = {name: frames[index] if index < len(frames) else sheets[name].iloc[0:0]
+                          for name, frames in parts.items()}
+                file_name = '月末库存呆滞情况.xlsx' if n_files == 1 else f'月末库存呆滞情况_{index + 1}.xlsx'
+                file_path = os.path.join(work_dir, file_name)
+                with stage(profiler, f'写出报表 {file_name}'):
+                    report.write_report(file_path, frames['物料'], frames['成品'], df2, frames['半成品'],
+                                        df5=summary if index == 0 else None, df6=delta if index == 0 else None,
+                                        profiler=profiler)
+                # xlsx 本身已压缩，直接存入
+                archive.write(file_path, file_name, compress_type=zipfile.ZIP_STORED)
+                os.remove(file_path)
+            if table_format is not None:
+                tables = {DETAIL_SHEETS[name]: sheets[name] for name in DETAIL_SHEETS}
+                if summary is not None:
+                    tables['汇总'] = summary
+                if delta is not None:
+                    tables['变动明细'] = delta
+                for table_name, df in tables.items():
+                    file_name = f'{table_name}.{table_format}'
+                    file_path = os.path.join(work_dir, file_name)
+                    with stage(profiler, f'写出明细 {file_name}', rows_in=len(df)):
+                        write_table(file_path, df, table_format)
+                        archive.write(file_path, file_name)
+                    os.remove(file_path)
+        os.replace(tmp_path, path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
+
+
+def new_export_path(export_dir):
+    os.makedirs(export_dir, exist_ok=True)
+    return os.path.join(export_dir, f'{time.strftime("%Y%m%d%H%M%S")}_{uuid.uuid4().hex[:8]}.zip')
+
+
+def cleanup_exports(export_dir, max_age=24 * 3600):
+    # 删除超过保留时间的导出文件
+    if not os.path.isdir(export_dir):
+        return 0
+    removed = 0
+    now = time.time()
+    for name in os.listdir(export_dir):
+        if not name.endswith('.zip'):
+            continue
+        file_path = os.path.join(export_dir, name)
+        try:
+            if now - os.path.getmtime(file_path) > max_age:
+                os.remove(file_path)
+                removed += 1
+        except OSError:
+            continue
+    return removed
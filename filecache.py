@@ -0,0 +1,272 @@
+# 上传文件解析结果的磁盘缓存（Parquet），以及报表文件缓存
+import os
+import json
+import time
+import hashlib
+import threading
+from io import BytesIO
+from collections import OrderedDict
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+# 混合类型 object 列的取值类型编码（Parquet 列必须为单一类型，需拆成 文本 + 类型 两列保存）
+_KIND_TEXT, _KIND_INT, _KIND_FLOAT, _KIND_DATETIME, _KIND_BOOL = range(5)
+_KIND_PREFIX = '__kind__'
+
+
+def _encode_mixed(df):
+    # 将无法直接写入 Parquet 的混合类型列转为文本列，并附加类型编码列以便还原
+    df = df.copy()
+    mixed_columns = []
+    for col in df.columns[df.dtypes == object]:
+        values = df[col].to_numpy()
+        kinds = np.full(len(values), _KIND_TEXT, dtype=np.int8)
+        texts = np.empty(len(values), dtype=object)
+        for i, value in enumerate(values):
+            if value is None:
+                texts[i] = None
+                continue
+            if isinstance(value, (bool, np.bool_)):
+                kinds[i] = _KIND_BOOL
+            elif isinstance(value, (int, np.integer)):
+                kinds[i] = _KIND_INT
+            elif isinstance(value, (float, np.floating)):
+                kinds[i] = _KIND_FLOAT
+            elif isinstance(value, datetime):
+                kinds[i] = _KIND_DATETIME
+                value = pd.Timestamp(value).isoformat()
+            elif not isinstance(value, str):
+                raise TypeError(f"列 '{col}' 含有无法缓存的类型 {type(value).__name__}")
+            texts[i] = str(value)
+        if (kinds == _KIND_TEXT).all():
+            continue
+        df[col] = texts
+        df[_KIND_PREFIX + col] = kinds
+        mixed_columns.append(col)
+    return df, mixed_columns
+
+
+def frame_to_bytes(df):
+    # DataFrame 序列化为 Parquet 字节流，可与报表一起存入 ArtifactCache
+    df_encoded, mixed_columns = _encode_mixed(df)
+    df_encoded.attrs = {'mixed_columns': json.dumps(mixed_columns, ensure_ascii=False)}
+    buffer = BytesIO()
+    df_encoded.to_parquet(buffer)
+    return buffer.getvalue()
+
+
+def frame_from_bytes(data):
+    df = pd.read_parquet(BytesIO(data))
+    df = _decode_mixed(df, json.loads(df.attrs.pop('mixed_columns', '[]')))
+    return df
+
+
+def make_fingerprint(*parts):
+    # 由若干输入生成缓存键：bytes 直接参与哈希，其余对象按 JSON 序列化
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, (bytes, bytearray)):
+            digest.update(hashlib.sha256(part).digest())
+        else:
+            digest.update(json.dumps(part, ensure_ascii=False, sort_keys=True, default=str).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _evict_dir(cache_dir, suffix, max_bytes):
+    # 按最近修改时间从旧到新删除文件，直到目录总大小不超过上限，返回删除的文件数
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith(suffix):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    evicted = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        _remove(path)
+        total -= size
+        evicted += 1
+    return evicted
+
+
+def _decode_mixed(df, mixed_columns):
+    for col in mixed_columns:
+        kinds = df.pop(_KIND_PREFIX + col).to_numpy()
+        texts = df[col].to_numpy()
+        values = texts.copy()
+        for kind, convert in ((_KIND_INT, int), (_KIND_FLOAT, float),
+                              (_KIND_DATETIME, lambda x: pd.Timestamp(x).to_pydatetime()),
+                              (_KIND_BOOL, lambda x: x == 'True')):
+            idx = np.flatnonzero(kinds == kind)
+            values[idx] = [convert(x) for x in texts[idx]]
+        df[col] = values
+    return df
+
+
+class ParquetCache:
+    # 按 文件内容哈希 + 读取参数 缓存解析后的 DataFrame，总大小超过上限时按最近使用时间淘汰
+    def __init__(self, cache_dir='.cache/uploads', max_bytes=512 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'errors': 0}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(data, *params):
+        # params 为影响解析结果的读取参数（表头行、保留列等）
+        digest = hashlib.sha256(data)
+        params = json.dumps([list(p) if isinstance(p, (list, tuple)) else p for p in params], ensure_ascii=False)
+        digest.update(params.encode('utf-8'))
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.parquet')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            df = pd.read_parquet(path)
+            mixed_columns = json.loads(df.attrs.get('mixed_columns', '[]'))
+            df = _decode_mixed(df, mixed_columns)
+            df.attrs.pop('mixed_columns', None)
+            # 更新访问时间，作为 LRU 淘汰依据
+            os.utime(path)
+        except FileNotFoundError:
+            self.stats['misses'] += 1
+            return None
+        except Exception:
+            # 缓存文件损坏时删除并按未命中处理
+            self.stats['errors'] += 1
+            self.stats['misses'] += 1
+            _remove(path)
+            return None
+        self.stats['hits'] += 1
+        return df
+
+    def put(self, key, df):
+        path = self._path(key)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            df_encoded, mixed_columns = _encode_mixed(df)
+            df_encoded.attrs = {'mixed_columns': json.dumps(mixed_columns, ensure_ascii=False)}
+            df_encoded.to_parquet(tmp_path)
+            os.replace(tmp_path, path)
+        except Exception:
+            # 缓存写入失败不影响主流程
+            self.stats['errors'] += 1
+            _remove(tmp_path)
+            return
+        # 从最久未使用的文件开始删除，直到总大小不超过上限
+        self.stats['evictions'] += _evict_dir(self.cache_dir, '.parquet', self.max_bytes)
+
+
+class ArtifactCache:
+    # 报表文件(bytes)缓存：内存中按 LRU 保留并限制总大小，超出 TTL 的条目失效
+    # 指定 spill_dir 时，被挤出内存的条目转存到磁盘，之后仍可命中
+    def __init__(self, max_bytes=256 * 1024 * 1024, ttl=7 * 24 * 3600, spill_dir=None, max_spill_bytes=1024 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.spill_dir = spill_dir
+        self.max_spill_bytes = max_spill_bytes
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'spills': 0}
+        self._entries = OrderedDict()  # key -> (写入时间, 数据)
+        self._size = 0
+        # Streamlit 的多个会话在不同线程中运行，共用同一个实例
+        self._lock = threading.Lock()
+        if spill_dir is not None:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    def _spill_path(self, key):
+        return os.path.join(self.spill_dir, f'{key}.bin')
+
+    def _expired(self, created):
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                created, data = entry
+                if not self._expired(created):
+                    self._entries.move_to_end(key)
+                    self.stats['hits'] += 1
+                    return data
+                self._discard(key)
+        data = self._read_spilled(key)
+        if data is None:
+            with self._lock:
+                self.stats['misses'] += 1
+            return None
+        created, data = data
+        with self._lock:
+            self.stats['hits'] += 1
+            self._store(key, created, data)
+        return data
+
+    def put(self, key, data):
+        with self._lock:
+            self._store(key, time.time(), data)
+
+    def _discard(self, key):
+        _, data = self._entries.pop(key)
+        self._size -= len(data)
+
+    def _store(self, key, created, data):
+        if key in self._entries:
+            self._discard(key)
+        self._entries[key] = (created, data)
+        self._size += len(data)
+        # 超出内存上限时淘汰最久未使用的条目
+        while self._size > self.max_bytes and self._entries:
+            old_key, (old_created, old_data) = self._entries.popitem(last=False)
+            self._size -= len(old_data)
+            self.stats['evictions'] += 1
+            self._spill(old_key, old_created, old_data)
+
+    def _spill(self, key, created, data):
+        if self.spill_dir is None or self._expired(created):
+            return
+        path = self._spill_path(key)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            # 以文件修改时间记录写入时间，用于 TTL 判断
+            os.utime(tmp_path, (created, created))
+            os.replace(tmp_path, path)
+        except OSError:
+            _remove(tmp_path)
+            return
+        self.stats['spills'] += 1
+        _evict_dir(self.spill_dir, '.bin', self.max_spill_bytes)
+
+    def _read_spilled(self, key):
+        if self.spill_dir is None:
+            return None
+        path = self._spill_path(key)
+        try:
+            created = os.path.getmtime(path)
+            if self._expired(created):
+                _remove(path)
+                return None
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        # 已重新载入内存，删除磁盘副本
+        _remove(path)
+        return created, data
@@ -0,0 +1,159 @@
+# 月度处理结果历史库（SQLite），按月份保存各工作表的分类结果及处理方案
+import os
+import sqlite3
+from datetime import datetime, timedelta
+import pandas as pd
+import dataprocess as dp
+
+# 记录来源：系统处理结果 / 上传的上月处理结果（含人工填写的处理方案）
+SOURCE_RUN = '系统处理'
+SOURCE_REVIEWED = '人工处理结果'
+
+
+def month_of(date_value):
+    return pd.Timestamp(date_value).strftime('%Y-%m')
+
+
+def previous_month(month):
+    first_day = datetime.strptime(month, '%Y-%m')
+    return (first_day - timedelta(days=1)).strftime('%Y-%m')
+
+
+def _quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+class HistoryStore:
+    def __init__(self, path='history/inventory_history.sqlite'):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS runs ('
+                '月份 TEXT NOT NULL, 工作表 TEXT NOT NULL, 来源 TEXT NOT NULL, 行数 INTEGER, 保存时间 TEXT, '
+                'PRIMARY KEY (月份, 工作表))'
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path)
+
+    def _table_columns(self, conn, table):
+        return [row[1] for row in conn.execute(f'PRAGMA table_info({_quote(table)})')]
+
+    def save_run(self, month, sheets, source=SOURCE_RUN):
+        # 保存（覆盖）某月的各工作表；系统处理结果不会覆盖已上传的人工处理结果
+        saved_at = datetime.now().isoformat(timespec='seconds')
+        with self._connect() as conn:
+            for sheet_name, df in sheets.items():
+                existing = conn.execute('SELECT 来源 FROM runs WHERE 月份 = ? AND 工作表 = ?',
+                                        (month, sheet_name)).fetchone()
+                if existing and existing[0] == SOURCE_REVIEWED and source == SOURCE_RUN:
+                    continue
+                table = f'history_{sheet_name}'
+                df = df.copy()
+                df.insert(0, '月份', month)
+                columns = self._table_columns(conn, table)
+                if columns:
+                    # 新增的列追加到已有表中
+                    for col in df.columns:
+                        if col not in columns:
+                            conn.execute(f'ALTER TABLE {_quote(table)} ADD COLUMN {_quote(col)}')
+                    conn.execute(f'DELETE FROM {_quote(table)} WHERE 月份 = ?', (month,))
+                df.to_sql(table, conn, if_exists='append', index=False)
+                if not columns:
+                    conn.execute(f'CREATE INDEX IF NOT EXISTS {_quote("idx_" + table)} ON {_quote(table)} (月份)')
+                conn.execute('INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?)',
+                             (month, sheet_name, source, len(df), saved_at))
+
+    def runs(self):
+        with self._connect() as conn:
+            return pd.read_sql('SELECT * FROM runs ORDER BY 月份, 工作表', conn)
+
+    def months(self, sheet_name=None):
+        sql = 'SELECT DISTINCT 月份 FROM runs'
+        params = ()
+        if sheet_name is not None:
+            sql += ' WHERE 工作表 = ?'
+            params = (sheet_name,)
+        with self._connect() as conn:
+            return sorted(row[0] for row in conn.execute(sql, params))
+
+    def latest_month_before(self, month):
+        earlier = [m for m in self.months() if m < month]
+        return earlier[-1] if earlier else None
+
+    def run_info(self, month):
+        # 某月各工作表的来源及保存时间，可用于判断历史记录是否更新
+        with self._connect() as conn:
+            return conn.execute('SELECT 工作表, 来源, 保存时间 FROM runs WHERE 月份 = ? ORDER BY 工作表',
+                                (month,)).fetchall()
+
+    def load(self, month, sheet_name):
+        table = f'history_{sheet_name}'
+        with self._connect() as conn:
+            if not self._table_columns(conn, table):
+                return None
+            df = pd.read_sql(f'SELECT * FROM {_quote(table)} WHERE 月份 = ?', conn, params=(month,))
+        if df.empty and month not in self.months(sheet_name):
+            return None
+        return df.drop(columns='月份')
+
+    def load_run(self, month, sheet_names=('物料', '成品', '半成品')):
+        sheets = {}
+        for sheet_name in sheet_names:
+            df = self.load(month, sheet_name)
+            if df is not None:
+                sheets[sheet_name] = df
+        return sheets
+
+    def load_history(self, sheet_name, n_months=None, columns=None):
+        # 读取最近 n 个月的记录（含 '月份' 列），columns 为需要的列
+        table = f'history_{sheet_name}'
+        months = self.months(sheet_name)
+        if n_months is not None:
+            months = months[-n_months:]
+        with self._connect() as conn:
+            available = self._table_columns(conn, table)
+            if not available or not months:
+                return pd.DataFrame(columns=['月份'] + list(columns or []))
+            selected = ['月份'] + [col for col in (columns or available) if col in available and col != '月份']
+            placeholders = ','.join('?' * len(months))
+            return pd.read_sql(
+                f'SELECT {",".join(_quote(col) for col in selected)} FROM {_quote(table)} '
+                f'WHERE 月份 IN ({placeholders}) ORDER BY 月份', conn, params=months)
+
+    def stale_months(self, sheet_name, month, n_months=12):
+        # 截至 month，每个键连续出现在该工作表（即连续被标记）的月数
+        history = self.load_history(sheet_name, columns=dp.SOLUTION_KEYS + ['分类', '现有量(主)'])
+        history = history[history['月份'] <= month]
+        months = sorted(history['月份'].unique())[-n_months:]
+        if not months or months[-1] != month:
+            return pd.DataFrame(columns=dp.SOLUTION_KEYS + ['连续标记月数'])
+        history = history[history['月份'].isin(months)].copy()
+        history['键'] = dp.normalize_keys(history)
+        present = history.drop_duplicates(['键', '月份']).pivot(index='键', columns='月份', values='分类').notna()
+        # 从最近月份向前数连续出现的月数
+        streak = present[months[::-1]].cumprod(axis=1).sum(axis=1)
+        current = history[history['月份'] == month].drop_duplicates('键').set_index('键')
+        result = current[dp.SOLUTION_KEYS + ['分类', '现有量(主)']].copy()
+        result['连续标记月数'] = streak.reindex(result.index).astype(int).to_numpy()
+        return result.reset_index(drop=True)
+
+    def summary(self, n_months=12):
+        # 最近 n 个月各工作表、各分类的行数
+        frames = []
+        for sheet_name in ('物料', '成品'):
+            history = self.load_history(sheet_name, n_months=n_months, columns=['分类'])
+            if history.empty:
+                continue
+            counts = history.groupby(['月份', '分类']).size().unstack(fill_value=0)
+            # 分类按优先级排列
+            labels = [label for label, _, _ in dp.CLASSIFICATION_RULES if label in counts.columns]
+            counts = counts[labels]
+            counts.insert(0, '工作表', sheet_name)
+            frames.append(counts.reset_index())
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,107 @@
+# 后台任务：月度处理在线程池中执行，页面按任务编号查询进度、取消任务或取回结果
+import time
+import uuid
+import threading
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# 任务状态
+PENDING = '排队中'
+RUNNING = '处理中'
+DONE = '已完成'
+FAILED = '失败'
+CANCELLED = '已取消'
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, name=''):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.status = PENDING
+        self.progress = 0.0
+        self.message = ''
+        self.events = []
+        self.result = None
+        self.error = None
+        self.traceback = None
+        self.created = time.time()
+        self.finished = None
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def done(self):
+        return self.status in FINISHED
+
+    @property
+    def cancel_requested(self):
+        return self._cancel.is_set()
+
+    def cancel(self):
+        # 协作式取消：任务在下一次报告进度时停止
+        self._cancel.set()
+
+    def report(self, message, progress=None):
+        # 由任务函数调用，更新进度；已请求取消时抛出 JobCancelled 结束任务
+        if self._cancel.is_set():
+            raise JobCancelled()
+        with self._lock:
+            self.message = message
+            if progress is not None:
+                self.progress = max(self.progress, min(float(progress), 1.0))
+            self.events.append((time.time(), message))
+
+
+class JobRunner:
+    # max_workers 为同时执行的任务数，其余任务排队；max_jobs 为保留的已结束任务数
+    def __init__(self, max_workers=2, max_jobs=20):
+        self.max_jobs = max_jobs
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='inventory-job')
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args, name='', **kwargs):
+        # func(job, *args, **kwargs) 的返回值作为任务结果
+        job = Job(name)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self._executor.submit(self._run, job, func, args, kwargs)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def _run(self, job, func, args, kwargs):
+        try:
+            if job.cancel_requested:
+                raise JobCancelled()
+            job.status = RUNNING
+            job.result = func(job, *args, **kwargs)
+            job.progress = 1.0
+            job.status = DONE
+        except JobCancelled:
+            job.status = CANCELLED
+        except Exception as e:
+            job.error = str(e)
+            job.traceback = traceback.format_exc()
+            job.status = FAILED
+        finally:
+            job.finished = time.time()
+
+    def _prune(self):
+        # 超出数量时丢弃最早结束的任务，未结束的任务始终保留
+        finished = [job_id for job_id, job in self._jobs.items() if job.done]
+        for job_id in finished[:max(len(finished) - self.max_jobs, 0)]:
+            del self._jobs[job_id]
@@ -0,0 +1,349 @@
+# EBS 库存导出文件（现有量/可用量查询）的读取
+import os
+from io import BytesIO
+from zipfile import ZipFile
+from xml.etree import ElementTree
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+from openpyxl.cell.cell import TYPE_ERROR, TYPE_NUMERIC
+from openpyxl.utils.cell import column_index_from_string, coordinate_from_string
+from pandas.io.parsers import TextParser
+import dataprocess as dp
+from profiling import Profiler, stage
+
+# 导出文件前 17 行为报表说明，第 18 行为表头
+HEADER_ROW = 17
+DATE_COLUMNS = ["生产日期", "失效日期"]
+# xlsx 中工作表 XML 的命名空间（输入检查时只解析表头行）
+XLSX_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+RELATIONSHIP_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+# 流式读取时每个数据块的行数
+CHUNK_SIZE = 10000
+# 文本及键列：保留单元格原值、不做数值推断，各数据块的类型一致（'00123' 与 123 不会因分块而互相转换）
+TEXT_COLUMNS = ['所属组织', '物料编码', '物料说明', '仓库', '批次', '单位(主)']
+# 解析结果格式版本，解析逻辑变化时递增，使旧的解析缓存失效
+PARSE_VERSION = 3
+# 上月处理结果中需要匹配处理方案的工作表
+OLD_RESULT_SHEETS = ['物料', '成品', '半成品']
+# 处理流程用到的库存导出列（分类、排序及报表输出）
+REQUIRED_COLUMNS = ['所属组织', '物料编码', '物料说明', '仓库', '批次', '现有量(主)', '单位(主)',
+                    '生产日期', '失效日期', '在库天数', '最近事务处理时间']
+# 上月处理结果各工作表中匹配处理方案所需的列（缺少 处理方案 列时只是没有可沿用的方案，不视为错误）
+OLD_RESULT_COLUMNS = dp.SOLUTION_KEYS
+
+
+def _convert_cell(cell):
+    # 与 pandas 的 openpyxl 读取逻辑保持一致
+    if cell.value is None:
+        return ""
+    elif cell.data_type == TYPE_ERROR:
+        return np.nan
+    elif cell.data_type == TYPE_NUMERIC:
+        val = int(cell.value)
+        if val == cell.value:
+            return val
+        return float(cell.value)
+    return cell.value
+
+
+def _parse_rows(header_names, rows):
+    # 借助 pandas 的 TextParser 完成与 read_excel 相同的类型推断和缺失值识别；TEXT_COLUMNS 只识别缺失值
+    dtype = {col: object for col in TEXT_COLUMNS if col in header_names}
+    parser = TextParser([header_names] + rows, header=0, skip_blank_lines=False, dtype=dtype or None)
+    return parser.read()
+
+
+def iter_inventory_chunks(data, header=HEADER_ROW, columns=None, dropna_subset=DATE_COLUMNS, chunk_size=CHUNK_SIZE):
+    # 以只读模式逐行读取第一个工作表，仅转换需要的列，按块返回 DataFrame
+    workbook = load_workbook(BytesIO(data), read_only=True, data_only=True)
+    try:
+        worksheet = workbook.worksheets[0]
+        worksheet.reset_dimensions()
+        rows = worksheet.iter_rows()
+        for _ in range(header):
+            next(rows, None)
+        header_cells = [_convert_cell(cell) for cell in next(rows, ())]
+        while header_cells and header_cells[-1] == "":
+            header_cells.pop()
+        # 表头按 pandas 规则生成列名（空列名为 Unnamed: n，重复列名追加 .1）
+        all_columns = _parse_rows(header_cells, []).columns
+        if columns is None:
+            columns = list(all_columns)
+        missing = [col for col in columns if col not in all_columns]
+        if missing:
+            raise ValueError(f"列 {missing} 不在文件中")
+        positions = [all_columns.get_loc(col) for col in columns]
+        width = max(positions) + 1
+        dropna_subset = list(dropna_subset or [])
+        dropna_positions = [columns.index(col) for col in dropna_subset]
+
+        # 行号与 read_excel 的默认索引一致
+        chunk, index = [], []
+        blank_rows = []
+        for row_number, row in enumerate(rows):
+            values = [_convert_cell(cell) for cell in row[:width]]
+            values += [""] * (width - len(values))
+            values = [values[pos] for pos in positions]
+            if dropna_positions and any(values[pos] == "" for pos in dropna_positions):
+                continue
+            if all(value == "" for value in values):
+                # 空行先暂存，之后出现数据行时再补回，与 read_excel 去除末尾空行的行为一致
+                blank_rows.append(row_number)
+                continue
+            chunk.extend([[""] * len(columns)] * len(blank_rows))
+            index.extend(blank_rows)
+            blank_rows = []
+            chunk.append(values)
+            index.append(row_number)
+            if len(chunk) >= chunk_size:
+                yield _finish_chunk(columns, chunk, index, dropna_subset)
+                chunk, index = [], []
+        if chunk:
+            yield _finish_chunk(columns, chunk, index, dropna_subset)
+    finally:
+        workbook.close()
+
+
+def _finish_chunk(columns, rows, index, dropna_subset):
+    df = _parse_rows(columns, rows)
+    df.index = index
+    if dropna_subset:
+        # 文本形式的缺失值（如 N/A）在类型推断后才能识别
+        df = df.dropna(subset=dropna_subset)
+    return df
+
+
+def read_inventory(data, header=HEADER_ROW, columns=None, dropna_subset=DATE_COLUMNS, chunk_size=CHUNK_SIZE):
+    # data 为文件内容(bytes)，columns 为需要保留的列；chunk_size 为 None 时用 read_excel 整表读取
+    if chunk_size is None:
+        df = pd.read_excel(BytesIO(data), header=header)
+        if dropna_subset:
+            df = df.dropna(subset=dropna_subset)
+        if columns is not None:
+            df = df[columns]
+        return df
+    chunks = list(iter_inventory_chunks(data, header=header, columns=columns,
+                                        dropna_subset=dropna_subset, chunk_size=chunk_size))
+    if not chunks:
+        return _parse_rows(columns, [])
+    return pd.concat(chunks)
+
+
+def parse_inventory(data, header=HEADER_ROW, columns=None, dropna_subset=DATE_COLUMNS, chunk_size=CHUNK_SIZE,
+                    profiler=None):
+    # 单个文件的完整解析：读取、列筛选、提取仓库代码、解析日期列
+    with stage(profiler, '读取工作表') as record:
+        df = read_inventory(data, header=header, columns=columns, dropna_subset=dropna_subset, chunk_size=chunk_size)
+        record['输出行数'] = len(df)
+    with stage(profiler, '仓库代码提取', rows_in=len(df)):
+        df = dp.add_warehouse_code(df, copy=False)
+    with stage(profiler, '日期解析', rows_in=len(df)):
+        return dp.parse_dates(df, copy=False)
+
+
+def parse_inventory_profiled(data, header=HEADER_ROW, columns=None, dropna_subset=DATE_COLUMNS, chunk_size=CHUNK_SIZE):
+    # 在工作进程中执行：各阶段记录在进程内的 Profiler 中，与解析结果一起返回 (DataFrame, 阶段记录)
+    profiler = Profiler()
+    df = parse_inventory(data, header, columns, dropna_subset, chunk_size, profiler=profiler)
+    return df, profiler.records
+
+
+def load_inventory_files(sources, columns=None, header=HEADER_ROW, dropna_subset=DATE_COLUMNS,
+                         chunk_size=CHUNK_SIZE, cache=None, max_workers=None, profiler=None):
+    # sources 为 (文件名, 文件内容) 列表；若提供 cache 则优先读取解析缓存
+    # 未命中缓存的文件交由进程池并行解析，max_workers 为 1 时在当前进程中依次解析
+    dfs = {}
+    pending = []
+    for name, data in sources:
+        key = cache.make_key(data, header, columns, dropna_subset, PARSE_VERSION) if cache is not None else None
+        df = None
+        if cache is not None:
+            with stage(profiler, f'读取解析缓存 {name}') as record:
+                df = cache.get(key)
+                record['输出行数'] = len(df) if df is not None else None
+        dfs[name] = df
+        if df is None:
+            pending.append((name, data, key))
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = min(max_workers, len(pending))
+    if max_workers > 1:
+        # 每个文件解析完成时记录一次（同时用于报告进度），工作进程中的各阶段记录作为其下一层
+        with stage(profiler, f'并行解析 {len(pending)} 个文件') as record:
+            results = [None] * len(pending)
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                futures = {executor.submit(parse_inventory_profiled, data, header, columns, dropna_subset,
+                                           chunk_size): i
+                           for i, (_, data, _) in enumerate(pending)}
+                try:
+                    for future in as_completed(futures):
+                        i = futures[future]
+                        results[i], records = future.result()
+                        if profiler is not None:
+                            profiler.add(f'解析文件 {pending[i][0]}', rows_out=len(results[i]), children=records)
+                except BaseException:
+                    # 出错或任务被取消（进度回调抛出异常）时，尚未开始的文件不再解析
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    raise
+            record['输出行数'] = sum(len(df) for df in results)
+    else:
+        results = []
+        for name, data, _ in pending:
+            with stage(profiler, f'解析文件 {name}') as record:
+                df = parse_inventory(data, header, columns, dropna_subset, chunk_size, profiler=profiler)
+                record['输出行数'] = len(df)
+            results.append(df)
+
+    for (name, _, key), df in zip(pending, results):
+        if cache is not None:
+            with stage(profiler, f'写入解析缓存 {name}', rows_in=len(df)):
+                cache.put(key, df)
+        dfs[name] = df
+    return dfs
+
+
+def read_old_results(data, sheet_names=OLD_RESULT_SHEETS):
+    # 上月处理结果文件只打开一次，读取其中存在的工作表
+    with pd.ExcelFile(BytesIO(data)) as excel:
+        return {name: excel.parse(name) for name in sheet_names if name in excel.sheet_names}
+
+
+# 输入检查：只读取表头行，在完整解析之前一次报告所有问题
+def _sheet_paths(archive):
+    # 工作表名 -> 压缩包内的 XML 路径，按工作簿中的顺序（不含图表页）
+    targets = {rel.get('Id'): rel.get('Target')
+               for rel in ElementTree.fromstring(archive.read('xl/_rels/workbook.xml.rels'))}
+    paths = {}
+    for sheet in ElementTree.fromstring(archive.read('xl/workbook.xml')).iter(f'{XLSX_NS}sheet'):
+        target = targets.get(sheet.get(f'{RELATIONSHIP_NS}id'), '')
+        if 'worksheets/' in target:
+            paths[sheet.get('name')] = target.lstrip('/') if target.startswith('/') else f'xl/{target}'
+    return paths
+
+
+def _read_row(archive, path, row_number):
+    # 流式解析工作表 XML，读到第 row_number 行（从 1 开始）即停止，返回 [(列序号, 类型, 值)]
+    current = 0
+    with archive.open(path) as src:
+        for _, element in ElementTree.iterparse(src):
+            if element.tag != f'{XLSX_NS}row':
+                continue
+            current = int(element.get('r', current + 1))
+            if current > row_number:
+                break
+            if current == row_number:
+                cells = []
+                for position, cell in enumerate(element.iter(f'{XLSX_NS}c')):
+                    reference = cell.get('r')
+                    column = column_index_from_string(coordinate_from_string(reference)[0]) if reference else position + 1
+                    cell_type = cell.get('t', 'n')
+                    if cell_type == 'inlineStr':
+                        value = ''.join(text.text or '' for text in cell.iter(f'{XLSX_NS}t'))
+                    else:
+                        value = cell.findtext(f'{XLSX_NS}v')
+                    cells.append((column, cell_type, value))
+                return cells
+            element.clear()
+    return []
+
+
+def _shared_strings(archive, indexes):
+    # 只解析到所需的最大序号为止
+    strings = {}
+    if not indexes or 'xl/sharedStrings.xml' not in archive.namelist():
+        return strings
+    last = max(indexes)
+    with archive.open('xl/sharedStrings.xml') as src:
+        index = 0
+        for _, element in ElementTree.iterparse(src):
+            if element.tag != f'{XLSX_NS}si':
+                continue
+            if index in indexes:
+                # 忽略注音（rPh）中的文本
+                texts = [element.find(f'{XLSX_NS}t')] + [run.find(f'{XLSX_NS}t') for run in element.iter(f'{XLSX_NS}r')]
+                strings[index] = ''.join(text.text or '' for text in texts if text is not None)
+            if index >= last:
+                break
+            index += 1
+            element.clear()
+    return strings
+
+
+def read_headers(data, header=HEADER_ROW, first_sheet_only=True):
+    # 只读取各工作表第 header+1 行，返回 {工作表名: 列名列表}（列名规则同 iter_inventory_chunks）
+    # 直接流式解析 xlsx 中的 XML：openpyxl 打开工作簿时会读取全部共享字符串，缺少尺寸信息时还会扫描整个工作表
+    with ZipFile(BytesIO(data)) as archive:
+        paths = _sheet_paths(archive)
+        rows = {}
+        for sheet_name, path in list(paths.items())[:1] if first_sheet_only else paths.items():
+            rows[sheet_name] = _read_row(archive, path, header + 1)
+        strings = _shared_strings(archive, {int(value) for cells in rows.values()
+                                            for _, cell_type, value in cells if cell_type == 's' and value})
+    headers = {}
+    for sheet_name, cells in rows.items():
+        header_cells = [""] * max((column for column, _, _ in cells), default=0)
+        for column, cell_type, value in cells:
+            if value is None or value == "":
+                continue
+            if cell_type == 's':
+                value = strings.get(int(value), "")
+            elif cell_type == 'n':
+                # 与 _convert_cell 一致：整数值的数字按整数处理
+                number = float(value)
+                value = int(number) if number.is_integer() else number
+            header_cells[column - 1] = value
+        while header_cells and header_cells[-1] == "":
+            header_cells.pop()
+        headers[sheet_name] = list(_parse_rows(header_cells, []).columns) if header_cells else []
+    return headers
+
+
+def check_inventory_files(sources, columns=None, header=HEADER_ROW, dropna_subset=DATE_COLUMNS):
+    # 检查各库存导出文件的表头，返回问题列表（为空表示通过）
+    required = list(dict.fromkeys(list(columns or []) + REQUIRED_COLUMNS + list(dropna_subset or [])))
+    problems = []
+    for name, data in sources:
+        try:
+            headers = read_headers(data, header=header)
+        except Exception as e:
+            problems.append(f"{name}：无法读取（{e}）")
+            continue
+        if not headers:
+            problems.append(f"{name}：文件中没有工作表")
+            continue
+        sheet_name, header_columns = next(iter(headers.items()))
+        if not header_columns:
+            problems.append(f"{name}：工作表 '{sheet_name}' 第 {header + 1} 行不是表头（为空）")
+            continue
+        missing = [col for col in required if col not in header_columns]
+        if missing:
+            problems.append(f"{name}：工作表 '{sheet_name}' 第 {header + 1} 行表头缺少列 {missing}")
+    return problems
+
+
+def check_old_results(data, name='上月处理结果', sheet_names=OLD_RESULT_SHEETS, delta_sheets=('物料', '成品')):
+    # 检查上月处理结果文件，返回 (问题, 提示)：至少包含一个需要匹配的工作表，且这些工作表包含匹配所需的键列；
+    # 缺少 处理方案 列或变动对比所需的列时仍可处理，只作提示
+    try:
+        headers = read_headers(data, header=0, first_sheet_only=False)
+    except Exception as e:
+        return [f"{name}：无法读取（{e}）"], []
+    present = [sheet_name for sheet_name in sheet_names if sheet_name in headers]
+    if not present:
+        return [f"{name}：没有工作表 {sheet_names} 中的任何一个（文件中为 {list(headers)}）"], []
+    problems, warnings = [], []
+    for sheet_name in present:
+        columns = headers[sheet_name]
+        missing = [col for col in OLD_RESULT_COLUMNS if col not in columns]
+        if missing:
+            problems.append(f"{name}：工作表 '{sheet_name}' 缺少列 {missing}")
+            continue
+        if '处理方案' not in columns:
+            warnings.append(f"{name}：工作表 '{sheet_name}' 没有 处理方案 列，上月处理方案将为空")
+        missing = [col for col in dp.DELTA_REQUIRED_COLUMNS if col not in columns]
+        if sheet_name in delta_sheets and missing:
+            warnings.append(f"{name}：工作表 '{sheet_name}' 缺少列 {missing}，不生成该表的变动明细")
+    return problems, warnings
@@ -0,0 +1,133 @@
+# 月末库存数据处理的完整流程，不依赖 Streamlit，页面(ISeom.py)与命令行(cli.py)共用
+import calendar
+from datetime import date, timedelta
+import pandas as pd
+import dataprocess as dp
+import export
+import history
+import loader
+import report
+from profiling import stage
+
+
+def last_day_of_previous_month(today=None):
+    today = today or date.today()
+    if today.month == 1:
+        year = today.year - 1
+        month = 12
+    else:
+        year = today.year
+        month = today.month - 1
+    _, last_day = calendar.monthrange(year, month)
+    return date(year, month, last_day)
+
+
+def resolve_old_results(store, month, old_data=None, profiler=None):
+    # 上传了上月处理结果时以其为准，并按上一个月份存入历史库；否则使用历史库中本月之前最近一个月的记录
+    # （该月为系统处理结果时，处理方案为空的行沿用其上月处理方案）
+    with stage(profiler, '读取上月处理结果'):
+        if old_data is not None:
+            old_results = loader.read_old_results(old_data)
+            if store is not None:
+                store.save_run(history.previous_month(month), old_results, source=history.SOURCE_REVIEWED)
+            return old_results
+        if store is None:
+            return {}
+        old_month = store.latest_month_before(month)
+        if not old_month:
+            return {}
+        old_results = store.load_run(old_month)
+        sources = {sheet_name: source for sheet_name, source, _ in store.run_info(old_month)}
+        for sheet_name, df in old_results.items():
+            if sources.get(sheet_name) == history.SOURCE_RUN:
+                old_results[sheet_name] = dp.fill_solutions(df)
+        return old_results
+
+
+def check_inputs(sources, config, old_data=None, profiler=None):
+    # 完整解析之前检查配置、各库存文件表头及上月处理结果的工作表，返回 (问题, 提示)：问题为空表示可以处理
+    with stage(profiler, '输入检查', rows_in=len(sources)):
+        problems = []
+        columns = config["columns_to_keep"]
+        missing = [col for col in loader.REQUIRED_COLUMNS if col not in columns]
+        if missing:
+            problems.append(f"配置 columns_to_keep 缺少处理所需的列 {missing}")
+        try:
+            dp.WarehouseRoutes.from_config(config)
+        except ValueError as e:
+            problems.append(f"配置 [warehouses]：{e}")
+        problems += loader.check_inventory_files(sources, columns=columns)
+        warnings = []
+        if old_data is not None:
+            old_problems, warnings = loader.check_old_results(old_data)
+            problems += old_problems
+    return problems, warnings
+
+
+def load_inventory(sources, config, cache=None, max_workers=None, profiler=None):
+    # sources 为 (文件名, 文件内容) 列表，config 为仓库配置（secrets 中的 [warehouses]），返回合并后的库存数据
+    with stage(profiler, '读取库存文件') as record:
+        dfs = loader.load_inventory_files(sources, columns=config["columns_to_keep"], cache=cache,
+                                          max_workers=max_workers, profiler=profiler)
+        # 各文件已在解析时完成空日期行剔除、列筛选及仓库代码提取；合并后文本列转换为 category
+        with stage(profiler, '合并及规范化'):
+            df_all = dp.normalize_inventory(pd.concat(dfs.values(), axis=0), copy=False)
+        record['输出行数'] = len(df_all)
+    return df_all
+
+
+def process_inventory(sources, date_value, config, old_results=None, cache=None, max_workers=None, profiler=None):
+    # 返回 {'sheets': {物料/成品/半成品: DataFrame}, 'match_stats': {工作表: 匹配统计}, 'summary': 分类汇总,
+    #       'delta': 与上月相比 新增/已解除/类别变动 的批次}
+    df_all = load_inventory(sources, config, cache=cache, max_workers=max_workers, profiler=profiler)
+    with stage(profiler, '分类计算', rows_in=len(df_all)):
+        sheets = dp.run_pipeline(df_all, date_value, dp.WarehouseRoutes.from_config(config), profiler=profiler)
+    match_stats = {}
+    with stage(profiler, '匹配上月处理方案'):
+        for sheet_name in loader.OLD_RESULT_SHEETS:
+            with stage(profiler, f'匹配上月处理方案[{sheet_name}]', rows_in=len(sheets[sheet_name])) as record:
+                # 上月结果中不存在的工作表按空表处理（上月处理方案全部为空）
+                df_old = (old_results or {}).get(sheet_name, sheets[sheet_name].iloc[0:0])
+                solution_index = dp.build_solution_index(df_old)
+                sheets[sheet_name], match_stats[sheet_name] = dp.match_old_solution(sheets[sheet_name], solution_index)
+                record['输出行数'] = len(sheets[sheet_name])
+    with stage(profiler, '分类汇总') as record:
+        summary = dp.summarize_sheets(sheets)
+        record['输出行数'] = len(summary)
+    with stage(profiler, '变动对比') as record:
+        delta = dp.compare_sheets(sheets, old_results)
+        record['输出行数'] = len(delta)
+    return {'sheets': sheets, 'match_stats': match_stats, 'summary': summary, 'delta': delta}
+
+
+def scenario_dates(date_value, offsets):
+    # 月末日期加上各偏移天数（如 0/30/60）
+    return [date_value + timedelta(days=int(offset)) for offset in sorted(set(offsets))]
+
+
+def process_scenarios(sources, date_value, offsets, config, cache=None, max_workers=None, profiler=None):
+    # 同一批库存按 月末日期 + 各偏移天数 分类，返回 dp.run_scenarios 的结果（明细、汇总）
+    df_all = load_inventory(sources, config, cache=cache, max_workers=max_workers, profiler=profiler)
+    with stage(profiler, '多日期分类', rows_in=len(df_all)):
+        return dp.run_scenarios(df_all, scenario_dates(date_value, offsets), dp.WarehouseRoutes.from_config(config),
+                                base_date=date_value)
+
+
+def write_monthly_report(output, sheets, summary=None, delta=None, profiler=None):
+    # output 可以是文件路径或 BytesIO；summary 为 None 时由各工作表重新汇总，delta 为 None 时不写变动明细
+    with stage(profiler, '生成报表'):
+        df2 = dp.generate_description_df()
+        if summary is None:
+            summary = dp.summarize_sheets(sheets)
+        report.write_report(output, sheets['物料'], sheets['成品'], df2, sheets['半成品'], df5=summary, df6=delta,
+                            profiler=profiler)
+
+
+def write_monthly_export(path, sheets, summary=None, delta=None, table_format=None, rows_per_file=export.ROWS_PER_FILE,
+                         profiler=None):
+    # 大报表导出为 zip 文件（按行数拆分的 Excel，可附带 CSV/Parquet 明细）
+    with stage(profiler, '生成报表'):
+        if summary is None:
+            summary = dp.summarize_sheets(sheets)
+        return export.write_export(path, sheets, summary=summary, delta=delta, table_format=table_format,
+                                   rows_per_file=rows_per_file, profiler=profiler)
@@ -0,0 +1,134 @@
+# 处理流程各阶段的耗时、内存及行数记录
+import os
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager, nullcontext
+import pandas as pd
+try:
+    import resource
+except ImportError:  # Windows 没有 resource 模块，不记录子进程内存
+    resource = None
+
+COLUMNS = ['阶段', '层级', '耗时(秒)', '峰值内存(MB)', '内存增量(MB)', '子进程峰值内存(MB)', '输入行数', '输出行数']
+
+# 阶段执行期间采样当前常驻内存的间隔（秒）
+SAMPLE_INTERVAL = 0.05
+
+
+def current_rss_mb():
+    # 当前进程此刻的常驻内存；仅 Linux 可读取，其余平台返回 None
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+
+
+def children_peak_rss_mb():
+    # 已结束子进程（如并行解析的进程池）中单个进程的最大峰值常驻内存
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # Linux 下单位为 KB，macOS 下为字节
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+class Profiler:
+    # on_stage(record, finished) 在每个阶段开始及正常结束时调用，可用于报告进度
+    def __init__(self, on_stage=None):
+        self.records = []
+        self.on_stage = on_stage
+        self._depth = 0
+        # 尚未结束的阶段，由采样线程更新其峰值内存
+        self._open = []
+        self._lock = threading.Lock()
+        self._stop = None
+
+    def _sample(self):
+        rss = current_rss_mb()
+        if rss is None:
+            return
+        with self._lock:
+            for record in self._open:
+                record['峰值内存(MB)'] = max(record['峰值内存(MB)'] or 0, rss)
+
+    def _run_sampler(self, stop):
+        while not stop.wait(SAMPLE_INTERVAL):
+            self._sample()
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        # 阶段可以嵌套，层级 0 为最外层；返回的记录中可填写 '输出行数'
+        # 峰值内存为阶段执行期间采样到的最大常驻内存，内存增量为阶段结束与开始时常驻内存之差
+        # 子进程峰值内存仅在阶段内有子进程结束并刷新了峰值时记录
+        record = {'阶段': name, '层级': self._depth, '耗时(秒)': None, '峰值内存(MB)': None, '内存增量(MB)': None,
+                  '子进程峰值内存(MB)': None, '输入行数': rows_in, '输出行数': None}
+        self.records.append(record)
+        if self.on_stage is not None:
+            self.on_stage(record, False)
+        rss_start = current_rss_mb()
+        children_start = children_peak_rss_mb()
+        with self._lock:
+            self._open.append(record)
+        self._sample()
+        if self._depth == 0 and rss_start is not None:
+            # 最外层阶段开始时启动采样线程，结束时停止
+            self._stop = threading.Event()
+            threading.Thread(target=self._run_sampler, args=(self._stop,), daemon=True).start()
+        self._depth += 1
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            self._depth -= 1
+            record['耗时(秒)'] = time.perf_counter() - start
+            self._sample()
+            with self._lock:
+                self._open.remove(record)
+            if self._depth == 0 and self._stop is not None:
+                self._stop.set()
+                self._stop = None
+            rss_end = current_rss_mb()
+            if rss_start is not None and rss_end is not None:
+                record['内存增量(MB)'] = rss_end - rss_start
+            children_end = children_peak_rss_mb()
+            if children_end is not None and children_end != children_start:
+                record['子进程峰值内存(MB)'] = children_end
+        if self.on_stage is not None:
+            self.on_stage(record, True)
+
+    def add(self, name, seconds=None, rows_in=None, rows_out=None, children=None):
+        # 记录已在别处（如工作进程中）完成的阶段，层级为当前层级，同样通知 on_stage
+        # children 为该处 Profiler 的 records，作为此阶段的下一层；未给出 seconds 时取其最外层阶段耗时之和
+        children = children or []
+        top = [child for child in children if child['层级'] == 0]
+        if seconds is None and top:
+            seconds = sum(child['耗时(秒)'] or 0 for child in top)
+        peaks = [child['峰值内存(MB)'] for child in children if child['峰值内存(MB)'] is not None]
+        record = {'阶段': name, '层级': self._depth, '耗时(秒)': seconds, '峰值内存(MB)': max(peaks, default=None),
+                  '内存增量(MB)': None, '子进程峰值内存(MB)': None, '输入行数': rows_in, '输出行数': rows_out}
+        self.records.append(record)
+        self.records.extend(dict(child, 层级=self._depth + 1 + child['层级']) for child in children)
+        if self.on_stage is not None:
+            self.on_stage(record, True)
+        return record
+
+    def total_seconds(self):
+        return sum(record['耗时(秒)'] or 0 for record in self.records if record['层级'] == 0)
+
+    def to_frame(self):
+        # 阶段名称按层级缩进，便于查看嵌套关系
+        df = pd.DataFrame(self.records, columns=COLUMNS)
+        df['阶段'] = ['  ' * level + name for name, level in zip(df['阶段'], df['层级'])]
+        return df.astype({'输入行数': 'Int64', '输出行数': 'Int64'})
+
+    def to_json(self):
+        return json.dumps({'合计(秒)': self.total_seconds(), '阶段': self.records}, ensure_ascii=False, indent=2)
+
+
+def stage(profiler, name, rows_in=None):
+    # 未传入 profiler 时不做记录（返回的记录不会被保存）
+    return profiler.stage(name, rows_in=rows_in) if profiler is not None else nullcontext({})
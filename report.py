@@ -0,0 +1,266 @@
+# 月末库存报表的 Excel 输出
+# 使用 openpyxl 的 write-only 模式逐行写出，样式按列预先设置一次，不再逐个单元格设置样式
+from datetime import date, datetime
+import pandas as pd
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, Alignment, PatternFill, Border, Side, NamedStyle
+from openpyxl.utils import get_column_letter
+from openpyxl.formatting.rule import DataBarRule, FormulaRule
+from profiling import stage
+
+# 与 pandas.to_excel 默认一致的日期格式
+DATETIME_FORMAT = 'YYYY-MM-DD HH:MM:SS'
+DATE_FORMAT = 'YYYY-MM-DD'
+# pandas.to_excel 的表头边框
+HEADER_BORDER = Border(left=Side(style='thin'), right=Side(style='thin'),
+                       top=Side(style='thin'), bottom=Side(style='thin'))
+CENTER = Alignment(horizontal="center", vertical="center")
+LEFT = Alignment(horizontal="left", vertical="center")
+# 报表内容或格式变化时递增，使已缓存的报表失效
+REPORT_VERSION = 3
+# 每次转换为 Python 对象的行数，限制写出时的内存占用
+WRITE_CHUNK_ROWS = 50000
+# Excel 单个工作表最多 1048576 行（含表头），超出时拆分到多个工作表
+MAX_SHEET_ROWS = 1048576 - 1
+
+
+def add_data_bar_rule(worksheet, start_row, end_row, column, color="c00000"):
+    # 范围字符串
+    range_str = f'{column}{start_row}:{column}{end_row}'
+    # 添加条件格式规则，排除负数
+    negative_rule = FormulaRule(formula=[f'AND({column}{start_row}<0)'], stopIfTrue=True)
+    worksheet.conditional_formatting.add(range_str, negative_rule)
+    # 添加数据条规则
+    data_bar_rule = DataBarRule(
+        start_type='num', start_value=0,
+        end_type='max',
+        color=color
+    )
+    worksheet.conditional_formatting.add(range_str, data_bar_rule)
+
+
+def _make_cell(worksheet, style=None, number_format=None, font=None, fill=None, alignment=None, border=None):
+    cell = WriteOnlyCell(worksheet)
+    # 先应用命名样式，再覆盖单项样式
+    if style is not None:
+        cell.style = style
+    if number_format is not None:
+        cell.number_format = number_format
+    if font is not None:
+        cell.font = font
+    if fill is not None:
+        cell.fill = fill
+    if alignment is not None:
+        cell.alignment = alignment
+    if border is not None:
+        cell.border = border
+    return cell
+
+
+class _ColumnFormat:
+    # 一列数据单元格的样式模板：普通值、日期时间值、日期值各一个，写出时只替换单元格的值
+    # 指定 date_format 时，日期时间值和日期值都使用该格式
+    def __init__(self, worksheet, style=None, alignment=None, date_format=None):
+        self.styled = style is not None or alignment is not None
+        self.plain = _make_cell(worksheet, style=style, alignment=alignment)
+        # 命名样式自带数字格式时沿用其格式，否则按 pandas 默认格式显示日期
+        self.datetime = _make_cell(worksheet, style=style, alignment=alignment,
+                                   number_format=date_format or (None if style else DATETIME_FORMAT))
+        self.date = _make_cell(worksheet, style=style, alignment=alignment,
+                               number_format=date_format or (None if style else DATE_FORMAT))
+
+
+def _column_values(series):
+    # 整列转换为 Python 对象数组（日期列为 Timestamp），缺失值统一为 None
+    values = series.astype(object).to_numpy(copy=True)
+    values[pd.isna(series).to_numpy()] = None
+    return values
+
+
+def _write_rows(worksheet, df, formats):
+    for start in range(0, len(df), WRITE_CHUNK_ROWS):
+        _write_chunk(worksheet, df.iloc[start:start + WRITE_CHUNK_ROWS], formats)
+
+
+def _write_chunk(worksheet, df, formats):
+    columns = [_column_values(df.iloc[:, i]) for i in range(df.shape[1])]
+    for row in zip(*columns):
+        cells = []
+        for value, fmt in zip(row, formats):
+            if value is None:
+                # 有样式的列保留空单元格的样式
+                if fmt.styled:
+                    fmt.plain.value = None
+                    cells.append(fmt.plain)
+                else:
+                    cells.append(None)
+                continue
+            if isinstance(value, datetime):
+                cell = fmt.datetime
+            elif isinstance(value, date):
+                cell = fmt.date
+            else:
+                cell = fmt.plain
+            cell.value = value
+            cells.append(cell)
+        worksheet.append(cells)
+
+
+def _header_cells(worksheet, df, fills, font, alignment=CENTER):
+    return [_make_cell(worksheet, font=font, fill=fills(col_idx), alignment=alignment, border=HEADER_BORDER)
+            for col_idx in range(1, df.shape[1] + 1)]
+
+
+def write_material_sheet(workbook, sheet_name, df):
+    worksheet = workbook.create_sheet(sheet_name)
+    # 设置列宽
+    widths = {1: 14, 6: 22, 9: 30}
+    for idx in range(1, df.shape[1] + 1):
+        worksheet.column_dimensions[get_column_letter(idx)].width = widths.get(idx, 16)
+    # 定义不同列所需的颜色
+    colors = {1: 'e26b0a', 2: '31869b', 3: 'e26b0a', 4: 'e26b0a', 5: 'e26b0a', 6: '76933c', 7: '76933c'}
+    default_color = "346c9c"
+    fills = {}
+    def header_fill(col_idx):
+        color = colors.get(col_idx, default_color)
+        if color not in fills:
+            fills[color] = PatternFill(start_color=color, end_color=color, fill_type="solid")
+        return fills[color]
+    header = _header_cells(worksheet, df, header_fill, Font(bold=True, color="FFFFFF"))
+    for cell, name in zip(header, df.columns):
+        cell.value = name
+    worksheet.append(header)
+    # 数据列：第 9 列左对齐，其余居中；剩余效期占比列使用百分比格式，生产日期、失效日期列只显示日期
+    percentage_idx = df.columns.get_loc('%(剩余效期/总效期)') + 1
+    date_cols = {df.columns.get_loc(name) + 1 for name in ("生产日期", "失效日期") if name in df.columns}
+    formats = []
+    for col_idx in range(1, df.shape[1] + 1):
+        formats.append(_ColumnFormat(
+            worksheet,
+            style="percentage_style" if col_idx == percentage_idx else None,
+            alignment=LEFT if col_idx == 9 else CENTER,
+            date_format=DATE_FORMAT if col_idx in date_cols else None
+        ))
+    # 增加数据条（写出行之前设置；空表没有数据区域）
+    if len(df):
+        add_data_bar_rule(worksheet, start_row=2, end_row=len(df) + 1, column='F')
+    _write_rows(worksheet, df, formats)
+
+
+def write_description_sheet(workbook, sheet_name, df2):
+    worksheet = workbook.create_sheet(sheet_name)
+    # 设置列宽
+    worksheet.column_dimensions['A'].width = 22
+    worksheet.column_dimensions['B'].width = 108
+    # 设置行高
+    for row in range(1, 12):  # 1~11行行高设置为36
+        worksheet.row_dimensions[row].height = 36
+    # 合并A1和B1
+    worksheet.merged_cells.add('A1:B1')
+    title_font = Font(bold=True, size=16)
+    body_font = Font(size=14, color="000000")
+    priority_font = Font(size=14, color="000000", bold=True)
+    for row_idx, row in enumerate(df2.itertuples(index=False, name=None), start=1):
+        cells = []
+        for col_idx, value in enumerate(row, start=1):
+            if row_idx == 1:
+                # 标题行
+                cell = _make_cell(worksheet, font=title_font, alignment=CENTER)
+            elif col_idx == 3:
+                # 优先级列
+                cell = _make_cell(worksheet, font=priority_font, alignment=CENTER)
+            else:
+                cell = _make_cell(worksheet, font=body_font, alignment=LEFT)
+            if not pd.isna(value):
+                cell.value = value
+            cells.append(cell)
+        worksheet.append(cells)
+
+
+def write_wip_sheet(workbook, sheet_name, df4):
+    worksheet = workbook.create_sheet(sheet_name)
+    # 设置 B~E 列列宽
+    for col_idx in range(2, 6):
+        worksheet.column_dimensions[get_column_letter(col_idx)].width = 28
+    # 表头：蓝色填充 + 白色加粗，第2/8列浅蓝色填充
+    header_fill = PatternFill(start_color="346c9c", end_color="346c9c", fill_type="solid")
+    header_yellow_fill = PatternFill(start_color="31869b", end_color="31869b", fill_type="solid")
+    header = _header_cells(worksheet, df4,
+                           lambda col_idx: header_yellow_fill if col_idx in (2, 8) else header_fill,
+                           Font(color="FFFFFF", bold=True))
+    for cell, name in zip(header, df4.columns):
+        cell.value = name
+    worksheet.append(header)
+    # C列居中；生产日期、失效日期列使用日期样式
+    header_names = df4.columns.tolist()
+    date_cols = {header_names.index("生产日期") + 1, header_names.index("失效日期") + 1}
+    formats = []
+    for col_idx in range(1, df4.shape[1] + 1):
+        if col_idx in date_cols:
+            formats.append(_ColumnFormat(worksheet, style="date_style"))
+        elif col_idx == 3:
+            formats.append(_ColumnFormat(worksheet, alignment=CENTER))
+        else:
+            formats.append(_ColumnFormat(worksheet))
+    _write_rows(worksheet, df4, formats)
+
+
+def write_summary_sheet(workbook, sheet_name, df5):
+    worksheet = workbook.create_sheet(sheet_name)
+    for idx in range(1, df5.shape[1] + 1):
+        worksheet.column_dimensions[get_column_letter(idx)].width = 16
+    header_fill = PatternFill(start_color="346c9c", end_color="346c9c", fill_type="solid")
+    header = _header_cells(worksheet, df5, lambda col_idx: header_fill, Font(bold=True, color="FFFFFF"))
+    for cell, name in zip(header, df5.columns):
+        cell.value = name
+    worksheet.append(header)
+    # 占比列使用百分比格式，其余居中
+    formats = [_ColumnFormat(worksheet, style="percentage_style" if str(name).endswith('占比') else None, alignment=CENTER)
+               for name in df5.columns]
+    _write_rows(worksheet, df5, formats)
+
+
+def shard_frames(df, max_rows):
+    # 按行数上限拆分；空表也返回一个分片，保留表头
+    if max_rows is None or len(df) <= max_rows:
+        return [df]
+    return [df.iloc[start:start + max_rows] for start in range(0, len(df), max_rows)]
+
+
+def shard_name(sheet_name, index):
+    # 第一个分片沿用原名称，之后为 物料(2)、物料(3)...
+    return sheet_name if index == 0 else f'{sheet_name}({index + 1})'
+
+
+def _write_sharded(workbook, write_sheet, sheet_name, df, max_rows, profiler):
+    for index, part in enumerate(shard_frames(df, max_rows)):
+        name = shard_name(sheet_name, index)
+        with stage(profiler, f'写出工作表[{name}]', rows_in=len(part)):
+            write_sheet(workbook, name, part)
+
+
+def write_report(output, df1, df3, df2, df4, sheet_name1='物料', sheet_name3='成品', sheet_name2='异常类别定义', sheet_name4='半成品在库天数',
+                 df5=None, sheet_name5='汇总', df6=None, sheet_name6='变动明细', max_sheet_rows=MAX_SHEET_ROWS, profiler=None):
+    workbook = Workbook(write_only=True)
+    # 百分比样式、日期样式
+    workbook.add_named_style(NamedStyle(name="percentage_style", number_format='0.00%'))
+    date_style = NamedStyle(name="date_style", number_format="yyyy-mm-dd")
+    date_style.alignment = Alignment(horizontal="center")
+    workbook.add_named_style(date_style)
+    # 各工作表分别记录耗时（write-only 模式下单元格在写出行时即完成样式及 XML 转换）
+    with stage(profiler, f'写出工作表[{sheet_name2}]', rows_in=len(df2)):
+        write_description_sheet(workbook, sheet_name2, df2)
+    # 明细工作表超过 max_sheet_rows 行时拆分为多个工作表
+    _write_sharded(workbook, write_material_sheet, sheet_name1, df1, max_sheet_rows, profiler)
+    _write_sharded(workbook, write_material_sheet, sheet_name3, df3, max_sheet_rows, profiler)
+    _write_sharded(workbook, write_wip_sheet, sheet_name4, df4, max_sheet_rows, profiler)
+    # 分类汇总（分类 × 所属组织 × 仓库代码）
+    if df5 is not None:
+        with stage(profiler, f'写出工作表[{sheet_name5}]', rows_in=len(df5)):
+            write_summary_sheet(workbook, sheet_name5, df5)
+    # 与上月相比新增、已解除及类别变动的批次（格式同汇总表）
+    if df6 is not None:
+        _write_sharded(workbook, write_summary_sheet, sheet_name6, df6, max_sheet_rows, profiler)
+    with stage(profiler, '保存工作簿'):
+        workbook.save(output)